@@ -1,2 +1,3 @@
 CLIENT_ID=
 CLIENT_SECRET=
+STORE_BACKEND=
@@ -1,30 +1,92 @@
+import asyncio
 import datetime
+import functools
+import hashlib
+from typing import Dict, Tuple
 
-from ollama import chat, Options
+from ollama import chat, AsyncClient, Options
 from ollama import ChatResponse
 
+from const import LLM_MAX_IN_FLIGHT
+from util.tracing import Tracer
 
-def extract_borrow_request(post_date: datetime.date, post_title: str):
-    with open('ai/extract_borrow_request.prompt', 'r') as f:
-        prompt = f.read()
+MODEL = 'llama3.2'
+PROMPT_PATH = 'ai/extract_borrow_request.prompt'
+
+# The client is shared across extractions so the connection to ollama is reused. Ollama queues
+# requests beyond its own parallelism anyway, capping in flight requests keeps the queue on our
+# side where waiting is free and doesn't count against ollama's timeouts. Both are bound to the
+# event loop they are first used on, so each loop gets its own, e.g. every asyncio.run in a process
+_LoopState = Tuple[AsyncClient, asyncio.Semaphore]
+_per_loop: Dict[asyncio.AbstractEventLoop, _LoopState] = {}
 
+
+def _get_options() -> Options:
     options = Options()
     options.temperature = 0
+    return options
+
+
+def _loop_state() -> _LoopState:
+    loop = asyncio.get_running_loop()
+    state = _per_loop.get(loop)
+    if state is None:
+        # Loops that were closed since can't be used again
+        for closed in [other for other in _per_loop if other.is_closed()]:
+            del _per_loop[closed]
+        state = _per_loop[loop] = (AsyncClient(), asyncio.Semaphore(LLM_MAX_IN_FLIGHT))
+    return state
+
+
+@functools.cache
+def _get_prompt() -> str:
+    with open(PROMPT_PATH, 'r') as f:
+        return f.read()
+
 
+def get_prompt_hash() -> str:
+    return hashlib.sha256(_get_prompt().encode()).hexdigest()
+
+
+def _get_messages(post_date: datetime.date, post_title: str):
+    prompt = _get_prompt()
     query = f'(Post Date: {post_date}) {post_title}'
 
+    return [
+        {
+            'role': 'system',
+            'content': prompt,
+        },
+        {
+            'role': 'user',
+            'content': query
+        }
+    ]
+
+
+def extract_borrow_request(post_date: datetime.date, post_title: str):
     response: ChatResponse = chat(
-        model='llama3.2',
-        options=options,
-        messages=[
-            {
-                'role': 'system',
-                'content': prompt,
-            },
-            {
-                'role': 'user',
-                'content': query
-            }
-        ])
+        model=MODEL,
+        options=_get_options(),
+        messages=_get_messages(post_date, post_title))
     print(response)
     return response.message.content
+
+
+async def extract_borrow_request_async(post_date: datetime.date, post_title: str) -> str:
+    """
+    Non-blocking version of `extract_borrow_request` for use on the event loop. Waits for a free
+    slot when LLM_MAX_IN_FLIGHT requests are already running.
+    """
+    client, in_flight = _loop_state()
+    with Tracer.span('ollama chat', 'llm', model=MODEL, title=post_title) as span:
+        async with in_flight:
+            # Time spent waiting for a free slot rather than on the model
+            span.set(queued_ms=span.elapsed_ms())
+            response: ChatResponse = await client.chat(
+                model=MODEL,
+                options=_get_options(),
+                messages=_get_messages(post_date, post_title))
+        span.set(prompt_tokens=response.prompt_eval_count, output_tokens=response.eval_count,
+                 bytes=len(response.message.content or ''))
+    return response.message.content
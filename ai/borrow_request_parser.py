@@ -0,0 +1,184 @@
+import calendar
+import datetime
+import re
+from typing import Optional, Tuple
+
+# Rule based fast path for `extract_borrow_request`. Handles titles following the r/borrow
+# convention with a single repayment, e.g.
+#   [REQ] ($40) (#Brooklyn, NY, USA) (Repay $45 by 1/17/2025) (Paypal, Cashapp, Zelle)
+# and produces the same JSON shape as the model. Anything it isn't certain about (multiple
+# installments, ambiguous day/month order, unusual layouts) returns None so the caller falls back
+# to the model.
+
+_REQ_PREFIX = re.compile(r'^\s*[\[(]\s*REQ\s*[\])]', re.IGNORECASE)
+_GROUP = re.compile(r'[\[(]([^\[\]()]*)[\])]')
+_LEFTOVER = re.compile(r'^[\s,\-]*$')
+
+_SYMBOL_CURRENCIES = {'$': 'USD', '£': 'GBP', '€': 'EUR'}
+_CURRENCY_CODES = 'USD|CAD|AUD|NZD|GBP|EUR'
+_MONEY_PATTERN = (r'(?P<prefix>[$£€])?\s*'
+                  r'(?P<whole>\d{1,3}(?:,\d{3})+|\d+)(?:\.(?P<fraction>\d{1,2}))?\s*'
+                  rf'(?P<suffix>[$£€])?(?:\s*(?P<code>{_CURRENCY_CODES})\b)?')
+_MONEY = re.compile(rf'^\s*{_MONEY_PATTERN}\s*$', re.IGNORECASE)
+
+_REPAY = re.compile(
+    rf'^\s*repay(?:ing|ment)?\s*:?\s*{_MONEY_PATTERN}'
+    r'\s*(?:by|on|before|due|due\s+on|-)?\s*(?P<date>.+?)\s*$',
+    re.IGNORECASE)
+
+_MONTHS = {name.lower(): idx for idx, name in enumerate(calendar.month_name) if name}
+_MONTHS.update({name.lower(): idx for idx, name in enumerate(calendar.month_abbr) if name})
+_MONTHS['sept'] = 9
+_MONTH = '|'.join(sorted(_MONTHS, key=len, reverse=True))
+_ORDINAL = r'(?:st|nd|rd|th)?'
+
+_NUMERIC_DATE = re.compile(r'^(\d{1,2})[/\-.](\d{1,2})(?:[/\-.](\d{2}|\d{4}))?$')
+_ISO_DATE = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})$')
+_MONTH_DAY = re.compile(rf'^({_MONTH})\.?\s+(\d{{1,2}}){_ORDINAL},?(?:\s+(\d{{4}}))?$',
+                        re.IGNORECASE)
+_DAY_MONTH = re.compile(rf'^(\d{{1,2}}){_ORDINAL}\s+(?:of\s+)?({_MONTH})\.?,?(?:\s+(\d{{4}}))?$',
+                        re.IGNORECASE)
+
+_PAYMENT_SPLIT = re.compile(r'\s*(?:,|/|&|\bor\b|\band\b)\s*', re.IGNORECASE)
+_PAYMENT_TYPE = re.compile(r'^[A-Za-z][A-Za-z .\'-]{0,29}$')
+
+
+class ParserStats:
+    """Counts how often the fast path resolved a title without the model."""
+    hits: int = 0
+    misses: int = 0
+
+    @classmethod
+    def record(cls, hit: bool) -> None:
+        if hit:
+            cls.hits += 1
+        else:
+            cls.misses += 1
+
+    @classmethod
+    def hit_rate(cls) -> float:
+        total = cls.hits + cls.misses
+        return cls.hits / total if total else 0.0
+
+
+def _parse_money(match: re.Match) -> Optional[Tuple[float, str]]:
+    prefix, suffix, code = match.group('prefix'), match.group('suffix'), match.group('code')
+    if prefix and suffix:
+        return None
+
+    amount = int(match.group('whole').replace(',', ''))
+    fraction = match.group('fraction')
+    if fraction and int(fraction):
+        amount += int(fraction) / 10 ** len(fraction)
+
+    if code is not None:
+        return amount, code.upper()
+    if prefix or suffix:
+        return amount, _SYMBOL_CURRENCIES[prefix or suffix]
+    # A bare number could be any currency
+    return None
+
+
+def _next_occurrence(post_date: datetime.date, month: int, day: int) -> Optional[datetime.date]:
+    # Repay dates without a year are always the next occurrence after the post date
+    for year in (post_date.year, post_date.year + 1):
+        try:
+            date = datetime.date(year, month, day)
+        except ValueError:
+            return None
+        if date >= post_date:
+            return date
+    return None
+
+
+def _build_date(post_date: datetime.date, year: Optional[str], month: int,
+                day: int) -> Optional[datetime.date]:
+    if year is None:
+        return _next_occurrence(post_date, month, day)
+    year = int(year)
+    if year < 100:
+        year += 2000
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _parse_date(post_date: datetime.date, text: str, currency_code: str) -> Optional[datetime.date]:
+    text = text.strip().rstrip('.')
+
+    if match := _ISO_DATE.match(text):
+        return _build_date(post_date, match.group(1), int(match.group(2)), int(match.group(3)))
+
+    if match := _NUMERIC_DATE.match(text):
+        first, second, year = int(match.group(1)), int(match.group(2)), match.group(3)
+        if currency_code in ('USD', 'CAD'):
+            month, day = first, second
+        elif first > 12 >= second:
+            # Day first is only certain when the first part can't be a month
+            month, day = second, first
+        else:
+            return None
+        return _build_date(post_date, year, month, day)
+
+    if match := _MONTH_DAY.match(text):
+        return _build_date(post_date, match.group(3), _MONTHS[match.group(1).lower()],
+                           int(match.group(2)))
+
+    if match := _DAY_MONTH.match(text):
+        return _build_date(post_date, match.group(3), _MONTHS[match.group(2).lower()],
+                           int(match.group(1)))
+
+    return None
+
+
+def parse_borrow_request(post_date: datetime.date, post_title: str) -> Optional[dict]:
+    """
+    Parse a standard single repayment [REQ] title. Returns the same structure the model produces
+    or None if the title can't be parsed with confidence.
+    """
+    prefix = _REQ_PREFIX.match(post_title)
+    if prefix is None:
+        return None
+    body = post_title[prefix.end():]
+
+    groups = _GROUP.findall(body)
+    if len(groups) != 4 or not _LEFTOVER.match(_GROUP.sub('', body)):
+        return None
+    amount_text, location_text, repay_text, payment_text = groups
+
+    if not location_text.strip().startswith('#'):
+        return None
+
+    amount_match = _MONEY.match(amount_text)
+    borrow = _parse_money(amount_match) if amount_match is not None else None
+    if borrow is None:
+        return None
+    borrow_amount, currency_code = borrow
+
+    repay_match = _REPAY.match(repay_text)
+    if repay_match is None:
+        return None
+    repay = _parse_money(repay_match)
+    if repay is None or repay[1] != currency_code or repay[0] < borrow_amount:
+        return None
+    repay_date = _parse_date(post_date, repay_match.group('date'), currency_code)
+    if repay_date is None or repay_date < post_date:
+        return None
+
+    payment_types = [p for p in _PAYMENT_SPLIT.split(payment_text.strip()) if p]
+    if not payment_types or not all(_PAYMENT_TYPE.match(p) for p in payment_types):
+        return None
+
+    return {
+        'borrow_date': str(post_date),
+        'borrow_amount': borrow_amount,
+        'currency_code': currency_code,
+        'payment_types': payment_types,
+        'repay_installments': [
+            {
+                'repay_amount': repay[0],
+                'repay_date': str(repay_date)
+            }
+        ]
+    }
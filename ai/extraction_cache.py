@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Optional
+
+from ai.borrow_request_extractor import MODEL, get_prompt_hash
+from const import EXTRACTION_CACHE_MAX_ENTRIES
+from util.fs import atomic_write
+
+_CACHE_PATH = 'data/extraction_cache.dat'
+
+
+class ExtractionCache:
+    """
+    Persistent cache of `extract_borrow_request` outputs. A request post title never changes so
+    once a post has been parsed the model never needs to see it again.
+
+    Entries are keyed by post id and title hash. The file as a whole is tied to the model and
+    prompt hash it was built with and is discarded when either changes.
+    """
+    prompt_hash: str
+    entries: OrderedDict[str, str]
+    dirty: bool
+
+    @classmethod
+    def __cls_init__(cls):
+        # Defaults
+        cls.prompt_hash = get_prompt_hash()
+        cls.entries = OrderedDict()
+        cls.dirty = False
+
+        if not os.path.exists(_CACHE_PATH):
+            return
+
+        try:
+            with open(_CACHE_PATH, 'r') as file:
+                json_dict = json.loads(file.read())
+        except (OSError, ValueError):
+            # Outputs can always be extracted again, an unreadable cache starts over empty
+            return
+        if isinstance(json_dict, dict) and json_dict.get('model') == MODEL and \
+                json_dict.get('prompt_hash') == cls.prompt_hash:
+            cls.entries = OrderedDict(json_dict.get('entries', {}))
+
+    @staticmethod
+    def _key(post_id: str, post_title: str) -> str:
+        title_hash = hashlib.sha256(post_title.encode()).hexdigest()[:16]
+        return f'{post_id}:{title_hash}'
+
+    @classmethod
+    def get(cls, post_id: str, post_title: str) -> Optional[str]:
+        key = cls._key(post_id, post_title)
+        output = cls.entries.get(key)
+        if output is not None:
+            # Keep the entry order as least -> most recently used for eviction. Only kept in
+            # memory until the next write, a hit alone doesn't rewrite the file
+            cls.entries.move_to_end(key)
+        return output
+
+    @classmethod
+    def put(cls, post_id: str, post_title: str, output: str) -> None:
+        key = cls._key(post_id, post_title)
+        cls.entries[key] = output
+        cls.entries.move_to_end(key)
+        while len(cls.entries) > EXTRACTION_CACHE_MAX_ENTRIES:
+            cls.entries.popitem(last=False)
+        cls.dirty = True
+
+    @classmethod
+    def save(cls):
+        if not cls.dirty:
+            return
+        atomic_write(_CACHE_PATH, json.dumps({
+            'model': MODEL,
+            'prompt_hash': cls.prompt_hash,
+            'entries': cls.entries
+        }))
+        cls.dirty = False
@@ -0,0 +1,126 @@
+import asyncio
+import datetime
+import json
+import random
+import time
+import tracemalloc
+from typing import Callable, List
+
+import asyncpraw
+
+from const import COMMENT_LIMIT
+from models.user_data import Comment
+from services.reddit_listing import parse_comment_listing
+
+# Compares turning comment listing pages into `Comment`s through asyncpraw's objector (the old
+# fetch path) against reading the raw listing JSON. Reports CPU time and allocations per
+# COMMENT_LIMIT comments.
+#
+# Run from the project root: `python -m benchmarks.bench_comment_listing [rounds]`
+
+
+def _make_page(rng: random.Random, start: int, size: int) -> dict:
+    now = time.time()
+    children = []
+    for idx in range(start, start + size):
+        subreddit = f'subreddit{rng.randint(0, 40)}'
+        # Trimmed down but representative of the fields reddit returns for each comment
+        children.append({'kind': 't1', 'data': {
+            'id': f'{idx + 10 ** 6:x}',
+            'name': f't1_{idx + 10 ** 6:x}',
+            'author': 'someuser',
+            'author_fullname': 't2_abc123',
+            'body': 'Lorem ipsum dolor sit amet ' * rng.randint(1, 10),
+            'body_html': '<div class="md"><p>Lorem ipsum</p></div>',
+            'created': now - idx * 3600,
+            'created_utc': now - idx * 3600,
+            'edited': False,
+            'score': rng.randint(-5, 500),
+            'ups': rng.randint(0, 500),
+            'downs': 0,
+            'controversiality': 0,
+            'gilded': 0,
+            'subreddit': subreddit,
+            'subreddit_id': f't5_{rng.randint(0, 10 ** 6):x}',
+            'subreddit_name_prefixed': f'r/{subreddit}',
+            'subreddit_type': 'public',
+            'link_id': f't3_{rng.randint(0, 10 ** 8):x}',
+            'link_title': 'Some post title',
+            'link_author': 'otheruser',
+            'link_permalink': 'https://www.reddit.com/r/x/comments/abc/some_post/',
+            'parent_id': f't3_{rng.randint(0, 10 ** 8):x}',
+            'permalink': '/r/x/comments/abc/some_post/def/',
+            'num_comments': rng.randint(0, 300),
+            'over_18': False,
+            'stickied': False,
+            'archived': False,
+            'locked': False,
+            'distinguished': None,
+            'all_awardings': [],
+            'awarders': [],
+            'treatment_tags': [],
+        }})
+    return {'kind': 'Listing', 'data': {'after': children[-1]['data']['name'], 'before': None,
+                                        'dist': size, 'children': children}}
+
+
+def _objector_path(reddit: asyncpraw.Reddit, pages: List[dict]) -> List[Comment]:
+    comments = []
+    for page in pages:
+        for comment in reddit._objector.objectify(page).children:
+            comments.append(Comment(
+                id=comment.id,
+                subreddit=comment.subreddit.display_name,
+                created_at=datetime.datetime.fromtimestamp(comment.created_utc).date(),
+                karma=comment.score
+            ))
+    return comments
+
+
+def _raw_path(pages: List[dict]) -> List[Comment]:
+    comments = []
+    for page in pages:
+        comments.extend(parse_comment_listing(page)[0])
+    return comments
+
+
+def _measure(label: str, fn: Callable[[], List[Comment]], rounds: int, baseline=None):
+    cpu_start = time.process_time()
+    for _ in range(rounds):
+        fn()
+    cpu = (time.process_time() - cpu_start) / rounds
+
+    tracemalloc.start()
+    result = fn()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    speedup = f' ({baseline / cpu:.1f}x)' if baseline else ''
+    print(f'{label:<20}{cpu * 1000:>8.2f} ms cpu{speedup:<8}{peak / 1024:>8.0f} KiB peak'
+          f'{retained / 1024:>8.0f} KiB retained')
+    return cpu
+
+
+async def main(rounds: int = 20):
+    rng = random.Random(0)
+    # Parsed fresh for every round since both paths read from decoded JSON
+    raw_pages = json.dumps([_make_page(rng, start, 100) for start in range(0, COMMENT_LIMIT, 100)])
+
+    reddit = asyncpraw.Reddit(client_id='benchmark', client_secret='benchmark',
+                              user_agent='benchmark', check_for_updates=False)
+    try:
+        assert _objector_path(reddit, json.loads(raw_pages)) == _raw_path(json.loads(raw_pages))
+
+        print(f'Parsing {COMMENT_LIMIT} comments, mean of {rounds} rounds')
+        baseline = _measure('asyncpraw objector',
+                            lambda: _objector_path(reddit, json.loads(raw_pages)), rounds)
+        _measure('raw listing', lambda: _raw_path(json.loads(raw_pages)), rounds, baseline)
+    finally:
+        await reddit.close()
+
+
+if __name__ == '__main__':
+    import sys
+
+    asyncio.run(main(*[int(arg) for arg in sys.argv[1:]]))
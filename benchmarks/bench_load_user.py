@@ -0,0 +1,274 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+import aiohttp
+from dotenv import load_dotenv
+
+from benchmarks.fake_servers import DatasetConfig, ServerConfig, serve
+
+# End to end user loads against local stand-ins for redditloans, reddit and ollama. Runs the same
+# load as LoadUserScreen for every user, then stores, refreshes and reads them back through
+# SaveState. Reports wall time, requests per endpoint and memory for each phase.
+#
+# Run from the project root: `python -m benchmarks.bench_load_user [options]`
+#
+# The fakes generate a synthetic dataset by default. `--record fixtures.json --usernames a,b`
+# proxies the real services (with the credentials in .env) and saves their responses,
+# `--replay fixtures.json` serves them back without network access.
+
+_PHASES = ['cold load', 'save', 'store read', 'refresh']
+
+# Budget for the fakes when real rate limits are off, high enough to never wait
+_UNLIMITED = (1_000_000.0, 1_000_000)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark user loads against local fakes')
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--loans', type=int, default=200, help='loans per user')
+    parser.add_argument('--comments', type=int, default=1000, help='comments per user')
+    parser.add_argument('--unparsed-rate', type=float, default=0.1,
+                        help='share of request titles only the model can read')
+    parser.add_argument('--deleted-rate', type=float, default=0.02,
+                        help='share of request posts that no longer exist')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='seconds added to every redditloans and reddit response')
+    parser.add_argument('--model-latency', type=float, default=0.3,
+                        help='seconds added to every ollama response')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of responses replaced with a 503')
+    parser.add_argument('--concurrency', type=int, default=1, help='users loaded at once')
+    parser.add_argument('--store', choices=['file', 'sqlite'], default='file')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--real-rate-limits', action='store_true',
+                        help='pace requests to the fakes with the real per host budgets')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='also report peak Python allocations per phase. Slows the run down')
+    parser.add_argument('--trace', metavar='PATH',
+                        help='save a trace of every stage, request and model call to PATH')
+    parser.add_argument('--trace-format', choices=['chrome', 'json'], default='chrome')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the app\'s logs')
+    fixtures = parser.add_mutually_exclusive_group()
+    fixtures.add_argument('--record', metavar='PATH', help='proxy the real services and save '
+                                                           'their responses to PATH')
+    fixtures.add_argument('--replay', metavar='PATH', help='serve responses recorded to PATH')
+    parser.add_argument('--usernames', help='comma separated users to record')
+    args = parser.parse_args()
+    if args.record and not args.usernames:
+        parser.error('--record needs --usernames')
+    if args.trace:
+        # The run happens in a scratch directory
+        args.trace = os.path.abspath(args.trace)
+    return args
+
+
+def _peak_rss_mib() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and KiB elsewhere
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+async def _server_stats(session: aiohttp.ClientSession, urls: Dict[str, str]) -> Dict[str, dict]:
+    stats = {}
+    for name, url in urls.items():
+        async with session.get(f'{url}/_bench/stats') as res:
+            stats[name] = await res.json()
+    return stats
+
+
+def _stats_delta(before: Dict[str, dict], after: Dict[str, dict]) -> dict:
+    requests = Counter()
+    errors = 0
+    for name, server_after in after.items():
+        for label, count in server_after['requests'].items():
+            requests[f'{name} {label}'] += count - before[name]['requests'].get(label, 0)
+        errors += server_after['errors'] - before[name]['errors']
+    return {'requests': {label: count for label, count in requests.items() if count},
+            'injected_errors': errors}
+
+
+async def _run(args, urls: Dict[str, str], usernames: List[str]) -> dict:
+    # Imported only now that the environment points the app at the fakes
+    import const
+    from ai.extraction_cache import ExtractionCache
+    from models.save_state import SaveState
+    from services.http_client import HttpClient
+    from services.user_loader import UserLoader
+    from util.tracing import Tracer
+
+    if not args.real_rate_limits:
+        for netloc in list(const.RATE_LIMITS):
+            const.RATE_LIMITS[netloc] = _UNLIMITED
+
+    SaveState.__cls_init__()
+    ExtractionCache.__cls_init__()
+    if args.trace:
+        Tracer.enable()
+    loaded = {}
+    app_errors: List[str] = []
+
+    async def _load(username: str, semaphore: asyncio.Semaphore, refresh: bool) -> None:
+        async with semaphore:
+            # Same steps as LoadUserScreen._load_user
+            loader = UserLoader(username, on_error=app_errors.append,
+                                previous_user_data=SaveState.get_user(username) if refresh else None)
+            try:
+                loaded[username] = await loader.load()
+            finally:
+                ExtractionCache.save()
+
+    async def _load_all(refresh: bool) -> None:
+        semaphore = asyncio.Semaphore(args.concurrency)
+        await asyncio.gather(*[_load(username, semaphore, refresh) for username in usernames])
+
+    async def _save() -> None:
+        for user_data in loaded.values():
+            SaveState.save_user(user_data)
+
+    async def _store_read() -> None:
+        # Cold start, the index and every user are read back from disk
+        SaveState.__cls_init__()
+        for username in usernames:
+            assert SaveState.get_user(username) is not None, username
+
+    steps: Dict[str, Callable] = {
+        'cold load': lambda: _load_all(refresh=False),
+        'save': _save,
+        'store read': _store_read,
+        'refresh': lambda: _load_all(refresh=True),
+    }
+
+    report = {'users': len(usernames), 'phases': {}}
+    async with aiohttp.ClientSession() as session:
+        try:
+            for phase in _PHASES:
+                before = await _server_stats(session, urls)
+                app_errors.clear()
+                if args.tracemalloc:
+                    tracemalloc.start()
+                start = time.perf_counter()
+                with Tracer.span(phase, 'phase'):
+                    await steps[phase]()
+                wall = time.perf_counter() - start
+                result = {'wall_seconds': round(wall, 3)}
+                if args.tracemalloc:
+                    result['peak_alloc_mib'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+                    tracemalloc.stop()
+                result.update(_stats_delta(before, await _server_stats(session, urls)))
+                result['app_errors'] = len(app_errors)
+                report['phases'][phase] = result
+        finally:
+            await HttpClient.close()
+            if args.trace:
+                Tracer.export(args.trace, args.trace_format)
+
+    report['loans'] = sum(len(user_data.loan_history) for user_data in loaded.values())
+    report['comments'] = sum(len(user_data.comments) for user_data in loaded.values())
+    report['peak_rss_mib'] = _peak_rss_mib()
+    return report
+
+
+def _print_report(report: dict) -> None:
+    print(f'{report["users"]} users, {report["loans"]} loans, {report["comments"]} comments')
+    for phase, result in report['phases'].items():
+        requests = result['requests']
+        line = (f'{phase:<12}{result["wall_seconds"]:>9.3f} s{sum(requests.values()):>7} requests'
+                f'{result["injected_errors"]:>5} injected{result["app_errors"]:>5} app errors')
+        if 'peak_alloc_mib' in result:
+            line += f'{result["peak_alloc_mib"]:>9.1f} MiB peak alloc'
+        print(line)
+        for label, count in sorted(requests.items()):
+            print(f'{"":<14}{label:<32}{count:>6}')
+    if report['peak_rss_mib'] is not None:
+        print(f'peak rss {report["peak_rss_mib"]:.1f} MiB')
+
+
+def main():
+    args = _parse_args()
+    # Errors the app reports are counted per phase, their log lines are only noise
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    mode = 'record' if args.record else 'replay' if args.replay else 'generate'
+    dataset_config = DatasetConfig(users=args.users, loans_per_user=args.loans,
+                                   comments_per_user=args.comments,
+                                   unparsed_title_rate=args.unparsed_rate,
+                                   deleted_post_rate=args.deleted_rate, seed=args.seed)
+    server_config = ServerConfig(latency=args.latency, error_rate=args.error_rate)
+    configs = {
+        'redditloans': server_config,
+        'reddit': server_config,
+        'reddit_api': server_config,
+        'ollama': ServerConfig(latency=args.model_latency, error_rate=args.error_rate),
+    }
+
+    # Servers run in their own process so they don't share the event loop, CPU time or memory
+    # being measured
+    context = multiprocessing.get_context('spawn')
+    conn, child_conn = context.Pipe()
+    server = context.Process(target=serve, daemon=True,
+                             args=(dataset_config, configs, mode, args.record or args.replay,
+                                   child_conn))
+    server.start()
+    urls = conn.recv()
+
+    if mode == 'record':
+        usernames = args.usernames.split(',')
+    elif mode == 'replay':
+        with open(args.replay, 'r') as f:
+            usernames = json.load(f)['usernames']
+    else:
+        usernames = dataset_config.usernames()
+    load_dotenv()
+    if mode != 'record':
+        # Only the real reddit checks credentials
+        os.environ.setdefault('CLIENT_ID', 'benchmark')
+        os.environ.setdefault('CLIENT_SECRET', 'benchmark')
+
+    os.environ['REDDITLOANS_URL'] = urls['redditloans']
+    os.environ['REDDIT_URL'] = urls['reddit']
+    os.environ['REDDIT_OAUTH_URL'] = urls['reddit']
+    os.environ['REDDIT_API_URL'] = urls['reddit_api']
+    os.environ['OLLAMA_HOST'] = urls['ollama']
+    os.environ['STORE_BACKEND'] = args.store
+    # asyncpraw would otherwise ask PyPI for a newer version
+    os.environ['praw_check_for_updates'] = 'False'
+
+    # Everything the app writes under data/ goes to a scratch directory so runs start cold and
+    # don't touch the real cache. The prompt is read relative to the working directory
+    project_dir = os.getcwd()
+    scratch_dir = tempfile.mkdtemp(prefix='bench_load_user_')
+    os.symlink(os.path.join(project_dir, 'ai'), os.path.join(scratch_dir, 'ai'))
+    os.chdir(scratch_dir)
+    try:
+        report = asyncio.run(_run(args, urls, usernames))
+        if mode == 'record':
+            conn.send(('save', usernames))
+            conn.recv()
+    finally:
+        os.chdir(project_dir)
+        shutil.rmtree(scratch_dir)
+        server.terminate()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import dataclasses
+import datetime
+import json
+import random
+import time
+from typing import Callable, List
+
+from dacite import from_dict, Config
+
+from const import COMMENT_LIMIT
+from models.activity_aggregates import ActivityAggregates
+from models.comment_history import CommentHistory
+from models.user_data import UserData, UserLoan, LoanRequest, LoanInstallment, Comment
+from models.user_data_codec import decode_user_data, encode_user_data, encode_loan
+
+# Compares decoding saved users with the hand written codec against the dacite path SaveState
+# used before. Both decode the same records, written before comments were stored columnar, so
+# the comparison isn't skewed by the record shape. The codec reads those through its migrations.
+# Decoding the current columnar shape is timed separately against the codec on the old shape.
+#
+# Run from the project root: `python -m benchmarks.bench_user_data_codec [users] [loans]`
+
+_DACITE_CONFIG = Config(type_hooks={
+    datetime.date: lambda x: datetime.datetime.strptime(x, '%Y-%m-%d').date(),
+    datetime.datetime: lambda x: datetime.datetime.strptime(x, '%Y-%m-%d %H:%M:%S.%f')
+})
+
+
+@dataclasses.dataclass
+class _LegacyUserData:
+    last_load: datetime.datetime
+    last_viewed: datetime.datetime
+    username: str
+    created_at: datetime.date
+    total_karma: int
+    comment_karma: int
+    comments: List[Comment]
+    loan_history: List[UserLoan]
+    is_in_usl: bool
+
+
+def _to_legacy_record(user_data: UserData) -> dict:
+    record = {field.name: getattr(user_data, field.name)
+              for field in dataclasses.fields(_LegacyUserData)}
+    record['comments'] = [dataclasses.asdict(comment) for comment in user_data.comments]
+    record['loan_history'] = [dataclasses.asdict(loan) for loan in user_data.loan_history]
+    return json.loads(json.dumps(record, default=str))
+
+
+def _make_user(idx: int, loan_count: int) -> UserData:
+    rng = random.Random(idx)
+    today = datetime.date.today()
+    now = datetime.datetime.now().replace(microsecond=123456)
+
+    def _day(days_back: int) -> datetime.date:
+        return today - datetime.timedelta(days=days_back)
+
+    user_data = UserData(
+        last_load=now,
+        last_viewed=now,
+        username=f'user{idx}',
+        created_at=_day(2000),
+        total_karma=rng.randint(0, 50000),
+        comment_karma=rng.randint(0, 20000),
+        comments=CommentHistory(
+            Comment(
+                id=f'{rng.getrandbits(32):x}',
+                subreddit=f'subreddit{rng.randint(0, 40)}',
+                created_at=_day(rng.randint(0, 365)),
+                karma=rng.randint(-5, 200)
+            )
+            for _ in range(COMMENT_LIMIT)
+        ),
+        loan_history=[
+            UserLoan(
+                lender=f'lender{rng.randint(0, 100)}',
+                borrower=f'user{idx}',
+                currency_code='USD',
+                borrow_amount=100.0,
+                borrow_date=_day(loan + 30),
+                is_borrower=True,
+                repaid_date=_day(loan),
+                repaid_amount=120.0,
+                loan_request=LoanRequest(
+                    created_at=_day(loan + 30),
+                    permalink=f'https://www.reddit.com/comments/{loan:x}',
+                    post_id=f'{loan:x}',
+                    borrow_amount=100,
+                    repay_installments=[LoanInstallment(repay_amount=120, repay_date=_day(loan))],
+                    payment_types=['PayPal', 'Zelle'],
+                    repay_amount=120,
+                    repay_date=_day(loan)
+                ),
+                loan_id=idx * loan_count + loan
+            )
+            for loan in range(loan_count)
+        ],
+        is_in_usl=False
+    )
+    user_data.activity = ActivityAggregates.from_comments(user_data.comments)
+    return user_data
+
+
+def _time(label: str, fn: Callable[[], object], baseline: float = None) -> float:
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    speedup = f' ({baseline / elapsed:.1f}x)' if baseline else ''
+    print(f'{label:<40}{elapsed * 1000:>10.1f} ms{speedup}')
+    return elapsed
+
+
+def main(user_count: int = 50, loan_count: int = 100):
+    users = [_make_user(idx, loan_count) for idx in range(user_count)]
+    records = json.dumps([encode_user_data(user) for user in users])
+    shared_loans = {loan.loan_id: json.loads(json.dumps(encode_loan(loan)))
+                    for user in users for loan in user.loan_history}
+
+    # The dacite path read records written with dataclasses.asdict(..., default=str)
+    legacy_records = json.dumps([_to_legacy_record(user) for user in users])
+
+    # Migrations rewrite records in place so every run gets its own copy, parsed before timing
+    assert [decode_user_data(record, shared_loans) for record in json.loads(records)] == users
+    assert [decode_user_data(record, {}) for record in json.loads(legacy_records)] == users
+    assert [from_dict(data_class=_LegacyUserData, data=record, config=_DACITE_CONFIG).comments
+            for record in json.loads(legacy_records)] == [list(user.comments) for user in users]
+
+    print(f'Decoding {user_count} users ({COMMENT_LIMIT} comments, {loan_count} loans each)')
+    print('Comments as a list of objects, loans inline')
+    copy = json.loads(legacy_records)
+    baseline = _time('  dacite.from_dict', lambda: [
+        from_dict(data_class=_LegacyUserData, data=record, config=_DACITE_CONFIG)
+        for record in copy
+    ])
+    copy = json.loads(legacy_records)
+    legacy_codec = _time('  decode_user_data', lambda: [decode_user_data(record, {})
+                                                        for record in copy], baseline)
+
+    print('Current shape, columnar comments and shared loans. Against the codec on the old shape')
+    copy = json.loads(records)
+    _time('  decode_user_data', lambda: [decode_user_data(record, shared_loans)
+                                         for record in copy], legacy_codec)
+
+
+if __name__ == '__main__':
+    import sys
+
+    main(*[int(arg) for arg in sys.argv[1:]])
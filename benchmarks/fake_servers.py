@@ -0,0 +1,455 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+# Local stand-ins for redditloans, reddit and ollama used by `bench_load_user`. Every server either
+# generates responses from a synthetic dataset, proxies to the real service and records what it
+# returns, or replays recorded responses. Latency and failures are injected on top in every mode.
+
+UPSTREAMS = {
+    'redditloans': 'https://redditloans.com',
+    'reddit': 'https://oauth.reddit.com',
+    'reddit_api': 'https://api.reddit.com',
+    'ollama': 'http://localhost:11434',
+}
+
+# Requests for the access token go to www.reddit.com rather than the OAuth host
+_TOKEN_UPSTREAM = 'https://www.reddit.com'
+
+_FORWARDED_HEADERS = ('Authorization', 'User-Agent', 'Content-Type', 'Accept')
+
+
+@dataclass
+class ServerConfig:
+    # Seconds added before every response
+    latency: float = 0.0
+    # Share of requests answered with a 503 instead
+    error_rate: float = 0.0
+
+
+@dataclass
+class DatasetConfig:
+    users: int = 5
+    loans_per_user: int = 200
+    comments_per_user: int = 1000
+    # Share of request titles the rule based parser can't read, so they go to the model
+    unparsed_title_rate: float = 0.1
+    # Share of request posts reddit no longer returns
+    deleted_post_rate: float = 0.02
+    # Share of users on the USL
+    usl_rate: float = 0.2
+    seed: int = 0
+
+    def usernames(self) -> List[str]:
+        return [f'benchuser{idx}' for idx in range(self.users)]
+
+
+def _base36(number: int) -> str:
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    out = ''
+    while True:
+        number, digit = divmod(number, 36)
+        out = digits[digit] + out
+        if not number:
+            return out
+
+
+class Dataset:
+    """Synthetic users, loans and request posts. The same config always builds the same data."""
+
+    def __init__(self, config: DatasetConfig):
+        rng = random.Random(config.seed)
+        self.config = config
+        self.now = time.time()
+        self.usernames = config.usernames()
+        self.usl = {name for name in self.usernames if rng.random() < config.usl_rate}
+
+        self.loans: Dict[int, dict] = {}
+        self.lent: Dict[str, List[int]] = defaultdict(list)
+        self.borrowed: Dict[str, List[int]] = defaultdict(list)
+        # Request posts by id and what the model answers for each title
+        self.posts: Dict[str, dict] = {}
+        self.extractions: Dict[str, str] = {}
+
+        for user_idx, username in enumerate(self.usernames):
+            for loan_idx in range(config.loans_per_user):
+                # Every tenth loan is with another benchmark user so stored loans get shared
+                if loan_idx % 10 == 0 and len(self.usernames) > 1:
+                    counterparty = self.usernames[(user_idx + 1) % len(self.usernames)]
+                else:
+                    counterparty = f'counterparty{rng.randrange(500)}'
+                lender, borrower = (username, counterparty) if loan_idx % 2 else \
+                    (counterparty, username)
+                self._add_loan(rng, len(self.loans) + 1, lender, borrower)
+
+    def _add_loan(self, rng: random.Random, loan_id: int, lender: str, borrower: str) -> None:
+        config = self.config
+        amount = rng.choice([25, 50, 100, 150, 200, 300, 500])
+        repay_amount = round(amount * 1.2)
+        created_at = self.now - rng.uniform(2, 700) * 86400
+        repaid_at = created_at + rng.uniform(5, 40) * 86400 if rng.random() < 0.8 else None
+        if repaid_at is not None and repaid_at > self.now:
+            repaid_at = None
+
+        post_id = _base36(10 ** 6 + loan_id)
+        post_created = created_at - rng.choice([0, 0, 0, 86400])
+        post_date = datetime.date.fromtimestamp(post_created)
+        due = post_date + datetime.timedelta(days=30)
+        if rng.random() < config.unparsed_title_rate:
+            # Installments are left to the model
+            second = due + datetime.timedelta(days=14)
+            title = (f'[REQ] (${amount}) (#Austin, TX, USA) (Repay ${repay_amount // 2} on '
+                     f'{due.month}/{due.day} and ${repay_amount - repay_amount // 2} on '
+                     f'{second.month}/{second.day}) (PayPal, Zelle)')
+            installments = [{'repay_amount': repay_amount // 2, 'repay_date': due.isoformat()},
+                            {'repay_amount': repay_amount - repay_amount // 2,
+                             'repay_date': second.isoformat()}]
+        else:
+            title = (f'[REQ] (${amount}) (#Austin, TX, USA) (Repay ${repay_amount} by '
+                     f'{due.month}/{due.day}/{due.year}) (PayPal, Zelle)')
+            installments = [{'repay_amount': repay_amount, 'repay_date': due.isoformat()}]
+
+        self.extractions[title] = json.dumps({
+            'borrow_date': post_date.isoformat(), 'borrow_amount': amount, 'currency_code': 'USD',
+            'payment_types': ['PayPal', 'Zelle'], 'repay_installments': installments})
+        if rng.random() >= config.deleted_post_rate:
+            self.posts[post_id] = {
+                'id': post_id, 'name': f't3_{post_id}', 'title': title, 'author': borrower,
+                'subreddit': 'borrow', 'created_utc': post_created,
+                'permalink': f'/r/borrow/comments/{post_id}/req/',
+            }
+
+        self.loans[loan_id] = {
+            'basic': {
+                'lender': lender,
+                'borrower': borrower,
+                'currency_code': 'USD',
+                'currency_exponent': 2,
+                'principal_minor': amount * 100,
+                'principal_repayment_minor': repay_amount * 100 if repaid_at else 0,
+                'created_at': created_at,
+                'repaid_at': repaid_at,
+            },
+            'events': [{'event_type': 'creation', 'occurred_at': created_at,
+                        'creation_permalink': f'https://www.reddit.com/comments/{post_id}/req/'}],
+        }
+        self.lent[lender.lower()].append(loan_id)
+        self.borrowed[borrower.lower()].append(loan_id)
+
+    def comment(self, username: str, idx: int) -> dict:
+        # Spread over a bit more than the activity window so paging stops at the cutoff
+        spacing = 400 * 86400 / max(self.config.comments_per_user, 1)
+        seed = sum(map(ord, username))
+        comment_id = _base36(10 ** 8 + seed * 10 ** 5 + idx)
+        return {'kind': 't1', 'data': {
+            'id': comment_id, 'name': f't1_{comment_id}', 'author': username,
+            'subreddit': f'subreddit{(seed + idx * 7) % 40}', 'body': 'Lorem ipsum dolor sit amet',
+            'created_utc': self.now - idx * spacing, 'score': (seed + idx) % 50,
+        }}
+
+
+Handler = Callable[[web.Request, re.Match], Awaitable[web.StreamResponse]]
+
+
+class Fixtures:
+    """Recorded responses of every server, kept in one JSON file."""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.usernames: List[str] = []
+        self.responses: Dict[str, Dict[str, dict]] = defaultdict(dict)
+
+    def load(self) -> 'Fixtures':
+        with open(self.path, 'r') as f:
+            data = json.load(f)
+        self.usernames = data['usernames']
+        self.responses.update(data['responses'])
+        return self
+
+    def save(self) -> None:
+        with open(self.path, 'w') as f:
+            json.dump({'usernames': self.usernames, 'responses': self.responses}, f)
+
+    @staticmethod
+    def key(method: str, path: str, query: str, body: bytes) -> str:
+        key = f'{method} {path.rstrip("/")}?{"&".join(sorted(query.split("&")))}'
+        if body:
+            key += ' ' + hashlib.sha256(body).hexdigest()[:16]
+        return key
+
+
+class FakeServer:
+    """Routes requests to generated responses, the real service or recorded fixtures."""
+    name: str
+
+    def __init__(self, dataset: Optional[Dataset], config: ServerConfig, fixtures: Fixtures,
+                 mode: str, seed: int = 0):
+        self.dataset = dataset
+        self.config = config
+        self.fixtures = fixtures
+        self.mode = mode
+        self.requests: Counter = Counter()
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._routes: List[Tuple[str, re.Pattern, str, Handler]] = [
+            (method, re.compile(pattern), label, handler)
+            for method, pattern, label, handler in self.routes()
+        ]
+
+    def routes(self) -> List[Tuple[str, str, str, Handler]]:
+        """(method, path regex, label, handler) of every endpoint the app calls."""
+        raise NotImplementedError
+
+    def upstream(self, path: str) -> str:
+        return UPSTREAMS[self.name]
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', self.handle)
+        app.on_cleanup.append(self._close)
+        return app
+
+    async def _close(self, _app) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        if request.path == '/_bench/stats':
+            return web.json_response({'requests': self.requests, 'errors': self.errors})
+
+        path = request.path.rstrip('/') or '/'
+        label, handler, match = 'other', None, None
+        for method, pattern, route_label, route_handler in self._routes:
+            route_match = pattern.fullmatch(path)
+            if method == request.method and route_match:
+                label, handler, match = route_label, route_handler, route_match
+                break
+        self.requests[label] += 1
+
+        if self.config.latency:
+            await asyncio.sleep(self.config.latency)
+        if self._rng.random() < self.config.error_rate:
+            self.errors += 1
+            return web.json_response({'error': 'injected failure'}, status=503)
+
+        body = await request.read()
+        key = Fixtures.key(request.method, path, request.query_string, body)
+        if self.mode == 'replay':
+            return self.replay(request, key, label)
+        if self.mode == 'record':
+            return await self._record(request, key, body)
+        if handler is None:
+            return web.json_response({'error': f'no fake for {request.method} {path}'},
+                                     status=404)
+        return await handler(request, match)
+
+    def replay(self, request: web.Request, key: str, label: str) -> web.Response:
+        fixture = self.fixtures.responses[self.name].get(key)
+        if fixture is None:
+            return web.json_response({'error': f'not recorded: {key}'}, status=404)
+        return web.Response(status=fixture['status'], text=fixture['body'],
+                            content_type=fixture['content_type'])
+
+    async def _record(self, request: web.Request, key: str, body: bytes) -> web.Response:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(auto_decompress=True)
+        headers = {name: request.headers[name] for name in _FORWARDED_HEADERS
+                   if name in request.headers}
+        async with self._session.request(
+                request.method, self.upstream(request.path) + request.path_qs, data=body or None,
+                headers=headers) as res:
+            text = await res.text()
+            content_type = res.content_type
+            if request.path.startswith('/api/v1/access_token') and res.status == 200:
+                # The client only needs a token shaped response on replay, never keep the real one
+                text = json.dumps({**json.loads(text), 'access_token': 'recorded'})
+            # Only what the app can replay is kept, throttled or failed responses are retried live
+            if res.status < 500 and res.status != 429:
+                self.fixtures.responses[self.name][key] = {
+                    'status': res.status, 'body': text, 'content_type': content_type}
+            return web.Response(status=res.status, text=text, content_type=content_type)
+
+
+class FakeRedditLoans(FakeServer):
+    name = 'redditloans'
+
+    def routes(self):
+        return [
+            ('GET', r'/api/loans', 'loan ids', self.loan_ids),
+            ('GET', r'/api/loans/(\d+)/detailed', 'loan record', self.loan_record),
+        ]
+
+    async def loan_ids(self, request: web.Request, _match) -> web.Response:
+        if 'lender_name' in request.query:
+            return web.json_response(self.dataset.lent.get(request.query['lender_name'].lower(), []))
+        return web.json_response(self.dataset.borrowed.get(
+            request.query.get('borrower_name', '').lower(), []))
+
+    async def loan_record(self, _request, match: re.Match) -> web.Response:
+        record = self.dataset.loans.get(int(match.group(1)))
+        if record is None:
+            return web.json_response({'error': 'not found'}, status=404)
+        return web.json_response(record)
+
+
+class FakeReddit(FakeServer):
+    name = 'reddit'
+    _recorded_posts: Optional[Dict[str, dict]] = None
+
+    def routes(self):
+        return [
+            ('POST', r'/api/v1/access_token', 'access token', self.access_token),
+            ('GET', r'/user/([^/]+)/about', 'user about', self.user_about),
+            ('GET', r'/user/([^/]+)/comments', 'comment listing', self.comment_listing),
+            ('GET', r'/api/info', 'submission info', self.info),
+        ]
+
+    def upstream(self, path: str) -> str:
+        return _TOKEN_UPSTREAM if path.startswith('/api/v1/access_token') else UPSTREAMS['reddit']
+
+    def replay(self, request: web.Request, key: str, label: str) -> web.Response:
+        if label != 'submission info':
+            return super().replay(request, key, label)
+        # Which posts share an info request depends on the order loan records arrive in, so
+        # posts are served from every recorded info response rather than by exact request
+        if self._recorded_posts is None:
+            self._recorded_posts = {}
+            for recorded_key, fixture in self.fixtures.responses[self.name].items():
+                if recorded_key.startswith('GET /api/info?') and fixture['status'] == 200:
+                    for child in json.loads(fixture['body'])['data']['children']:
+                        self._recorded_posts[child['data']['name']] = child
+        children = [self._recorded_posts[fullname]
+                    for fullname in request.query.get('id', '').split(',')
+                    if fullname in self._recorded_posts]
+        return web.json_response({'kind': 'Listing', 'data': {
+            'after': None, 'before': None, 'dist': len(children), 'children': children}})
+
+    async def access_token(self, _request, _match) -> web.Response:
+        return web.json_response({'access_token': 'benchmark', 'token_type': 'bearer',
+                                  'expires_in': 86400, 'scope': '*'})
+
+    async def user_about(self, _request, match: re.Match) -> web.Response:
+        username = match.group(1)
+        if username not in self.dataset.usernames:
+            return web.json_response({'message': 'Not Found', 'error': 404}, status=404)
+        created = self.dataset.now - 900 * 86400
+        return web.json_response({'kind': 't2', 'data': {
+            'name': username, 'id': _base36(sum(map(ord, username))), 'created': created,
+            'created_utc': created, 'total_karma': 5400, 'comment_karma': 2100, 'link_karma': 3300,
+        }})
+
+    async def comment_listing(self, request: web.Request, match: re.Match) -> web.Response:
+        username = match.group(1)
+        total = self.dataset.config.comments_per_user if username in self.dataset.usernames else 0
+        after = request.query.get('after')
+        start = int(after.rsplit('_', 1)[1]) + 1 if after else 0
+        end = min(start + int(request.query.get('limit', 25)), total)
+        children = [self.dataset.comment(username, idx) for idx in range(start, end)]
+        return web.json_response({'kind': 'Listing', 'data': {
+            # The cursor is the index of the last comment rather than its fullname to keep paging
+            # stateless
+            'after': f't1_{end - 1}' if end < total else None, 'before': None,
+            'dist': len(children), 'children': children,
+        }})
+
+    async def info(self, request: web.Request, _match) -> web.Response:
+        children = []
+        for fullname in request.query.get('id', '').split(','):
+            post = self.dataset.posts.get(fullname[3:])
+            if post is not None:
+                children.append({'kind': 't3', 'data': post})
+        return web.json_response({'kind': 'Listing', 'data': {
+            'after': None, 'before': None, 'dist': len(children), 'children': children}})
+
+
+class FakeRedditApi(FakeServer):
+    name = 'reddit_api'
+
+    def routes(self):
+        return [
+            ('GET', r'/r/RegExrSwapBot/wiki/confirmations/([^/]+)\.json', 'usl status',
+             self.usl_status),
+        ]
+
+    async def usl_status(self, _request, match: re.Match) -> web.Response:
+        usl = {name.lower() for name in self.dataset.usl}
+        if match.group(1) not in usl:
+            return web.json_response({'message': 'Not Found', 'error': 404}, status=404)
+        return web.json_response({'kind': 'wikipage', 'data': {'content_md': 'confirmed'}})
+
+
+class FakeOllama(FakeServer):
+    name = 'ollama'
+
+    def routes(self):
+        return [('POST', r'/api/chat', 'chat', self.chat)]
+
+    async def chat(self, request: web.Request, _match) -> web.Response:
+        body = await request.json()
+        # The user message is `(Post Date: yyyy-mm-dd) <title>`
+        title = body['messages'][-1]['content'].split(') ', 1)[-1]
+        content = self.dataset.extractions.get(title) or json.dumps({
+            'borrow_date': None, 'borrow_amount': None, 'currency_code': None,
+            'payment_types': [], 'repay_installments': []})
+        return web.json_response({
+            'model': body['model'],
+            'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'message': {'role': 'assistant', 'content': content},
+            'done': True,
+            'done_reason': 'stop',
+            'total_duration': int(self.config.latency * 1e9),
+        })
+
+
+_SERVERS = (FakeRedditLoans, FakeReddit, FakeRedditApi, FakeOllama)
+
+
+async def _serve(dataset_config: DatasetConfig, configs: Dict[str, ServerConfig], mode: str,
+                 fixtures_path: Optional[str], conn) -> None:
+    fixtures = Fixtures(fixtures_path)
+    if mode == 'replay':
+        fixtures.load()
+    dataset = Dataset(dataset_config) if mode == 'generate' else None
+
+    runners = []
+    urls = {}
+    for idx, server_class in enumerate(_SERVERS):
+        server = server_class(dataset, configs.get(server_class.name, ServerConfig()), fixtures,
+                              mode, seed=dataset_config.seed + idx)
+        runner = web.AppRunner(server.app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        runners.append(runner)
+        port = site._server.sockets[0].getsockname()[1]
+        urls[server.name] = f'http://127.0.0.1:{port}'
+    conn.send(urls)
+
+    # Runs until the benchmark asks for the fixtures to be saved or terminates the process
+    try:
+        while True:
+            message = await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+            if message[0] == 'save':
+                fixtures.usernames = message[1]
+                fixtures.save()
+                conn.send(True)
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def serve(dataset_config: DatasetConfig, configs: Dict[str, ServerConfig], mode: str,
+          fixtures_path: Optional[str], conn) -> None:
+    """Process entry point. Sends the base URL of every server over conn once they are up."""
+    asyncio.run(_serve(dataset_config, configs, mode, fixtures_path, conn))
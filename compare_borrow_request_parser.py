@@ -0,0 +1,62 @@
+import asyncio
+import datetime
+import json
+import sys
+
+from ai.borrow_request_extractor import extract_borrow_request_async
+from ai.borrow_request_parser import parse_borrow_request, ParserStats
+
+# Compares the rule based title parser against the model. Input is one post per line in the form
+# `YYYY-MM-DD<TAB>title` read from the file given as the first argument or stdin.
+
+
+def _normalize(extracted: dict):
+    installments = extracted.get('repay_installments') or []
+    return (
+        float(extracted['borrow_amount']) if extracted.get('borrow_amount') is not None else None,
+        [p.lower() for p in extracted.get('payment_types') or []],
+        [(float(i['repay_amount']) if i.get('repay_amount') is not None else None,
+          i.get('repay_date')) for i in installments],
+    )
+
+
+async def _compare(post_date: datetime.date, post_title: str):
+    parsed = parse_borrow_request(post_date, post_title)
+    ParserStats.record(hit=parsed is not None)
+    if parsed is None:
+        return None
+
+    ai_out = await extract_borrow_request_async(post_date, post_title)
+    try:
+        ai_json = json.loads(ai_out)
+    except json.JSONDecodeError:
+        print(f'MODEL ERROR\t{post_title}\t{ai_out}')
+        return None
+
+    agrees = _normalize(parsed) == _normalize(ai_json)
+    if not agrees:
+        print(f'MISMATCH\t{post_title}\n  parser: {json.dumps(parsed)}\n  model:  {ai_out}')
+    return agrees
+
+
+async def main():
+    lines = (open(sys.argv[1]) if len(sys.argv) > 1 else sys.stdin).read().splitlines()
+    posts = []
+    for line in lines:
+        if not line.strip():
+            continue
+        post_date, post_title = line.split('\t', 1)
+        posts.append((datetime.datetime.strptime(post_date, '%Y-%m-%d').date(), post_title))
+
+    results = await asyncio.gather(*[_compare(*post) for post in posts])
+    compared = [r for r in results if r is not None]
+
+    print(f'Titles: {len(posts)}')
+    print(f'Parser hit rate: {ParserStats.hit_rate():.1%} '
+          f'(model calls avoided: {ParserStats.hits})')
+    if compared:
+        print(f'Agreement with model: {sum(compared) / len(compared):.1%} of {len(compared)}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,2 +1,46 @@
+import os
+from urllib.parse import urlsplit
+
 ACTIVITY_DAYS_BACK = 365
 COMMENT_LIMIT = 1000
+LOAN_FETCH_CONCURRENCY = 8
+# Request posts are looked up in batches of loan records, at most one info request's worth. A
+# partial batch waits this long for more records before it goes out
+REDDIT_INFO_BATCH_SIZE = 100
+LOAN_BATCH_WAIT_SECONDS = 0.5
+HTTP_MAX_CONNECTIONS = 32
+HTTP_MAX_CONNECTIONS_PER_HOST = 8
+HTTP_KEEPALIVE_SECONDS = 30
+HTTP_TIMEOUT_SECONDS = 30
+LLM_MAX_IN_FLIGHT = 2
+EXTRACTION_CACHE_MAX_ENTRIES = 50000
+USER_CACHE_SIZE = 16
+# Most rows the home screen lists at once. Typing a username narrows the list down
+HOME_USER_LIST_LIMIT = 50
+MIN_KARMA = 2000
+MIN_COMMENT_KARMA = 800
+MIN_AGE_DAYS = 120
+VET_CONCURRENCY = 4
+HTTP_CACHE_MAX_BYTES = 64 * 1024 * 1024
+HTTP_CACHE_LOAN_LIST_TTL = 60
+HTTP_CACHE_UNPAID_LOAN_TTL = 15 * 60
+HTTP_CACHE_USL_TTL = 6 * 60 * 60
+# Service base URLs. Overridable from the environment, e.g. to point the app at the benchmark fakes
+REDDITLOANS_URL = os.getenv('REDDITLOANS_URL', 'https://redditloans.com')
+REDDIT_URL = os.getenv('REDDIT_URL', 'https://www.reddit.com')
+REDDIT_OAUTH_URL = os.getenv('REDDIT_OAUTH_URL', 'https://oauth.reddit.com')
+REDDIT_API_URL = os.getenv('REDDIT_API_URL', 'https://api.reddit.com')
+# Starting budgets per host as (requests per second, burst). Adjusted at runtime from responses
+RATE_LIMITS = {
+    urlsplit(REDDITLOANS_URL).netloc: (10.0, 10),
+    urlsplit(REDDIT_OAUTH_URL).netloc: (1.5, 10),
+    urlsplit(REDDIT_API_URL).netloc: (0.5, 5),
+}
+RATE_LIMIT_DEFAULT = (5.0, 5)
+RATE_LIMIT_MAX_SCALE = 4
+HTTP_MAX_RETRIES = 4
+HTTP_BACKOFF_BASE_SECONDS = 0.5
+HTTP_BACKOFF_MAX_SECONDS = 30
+UI_MAX_FPS = 30
+# Spans kept while tracing, the oldest are dropped past this
+TRACE_MAX_SPANS = 100000
@@ -1,7 +1,13 @@
+import os
+
+from dotenv import load_dotenv
 from textual.app import App
 
+from ai.extraction_cache import ExtractionCache
 from models.save_state import SaveState
 from screens.home_screen import HomeScreen
+from services.http_client import HttpClient
+from util.tracing import Tracer
 
 
 class CredditorApp(App):
@@ -9,6 +15,7 @@ class CredditorApp(App):
         'main.tcss',
         'screens/home_screen.tcss',
         'screens/user_screen.tcss',
+        'widgets/loan_history_widget.tcss',
         'widgets/progress_tracker_widget.tcss',
         'widgets/reddit_activity_widget.tcss',
     ]
@@ -16,10 +23,18 @@ class CredditorApp(App):
     def on_mount(self):
         self.push_screen(HomeScreen())
 
+    async def on_unmount(self):
+        await HttpClient.close()
+
 
 def main():
+    load_dotenv()
     SaveState.__cls_init__()
+    ExtractionCache.__cls_init__()
     app = CredditorApp()
+    # Dev mode (`textual run --dev`) traces every load and adds a Trace tab to the user screen
+    if 'devtools' in app.features or os.getenv('TRACE'):
+        Tracer.enable()
     app.run()
 
 
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import datetime
+from array import array
+from typing import Dict, Iterable, Iterator, List, Set, Union
+
+from models.user_data import Comment
+
+# date.toordinal() of 1970-01-01. Dates are stored as days since the unix epoch
+EPOCH_ORDINAL = 719163
+
+_BASE36 = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def _to_base36(value: int) -> str:
+    digits = []
+    while True:
+        value, digit = divmod(value, 36)
+        digits.append(_BASE36[digit])
+        if value == 0:
+            return ''.join(reversed(digits))
+
+
+class CommentHistory:
+    """
+    Columnar store for a user's comments. Each field is held in a typed array (ids as integers,
+    subreddits as indexes into an interned name list, dates as epoch days) instead of one object
+    per comment. Iterating yields `Comment` rows built on demand.
+
+    Comments are kept in the order they were added, newest first as returned by reddit.
+    """
+    __slots__ = ('ids', 'subreddit_indexes', 'days', 'karma', 'subreddits', '_subreddit_lookup')
+
+    def __init__(self, comments: Iterable[Comment] = ()):
+        self.ids = array('q')
+        self.subreddit_indexes = array('I')
+        self.days = array('i')
+        self.karma = array('i')
+        self.subreddits: List[str] = []
+        self._subreddit_lookup: Dict[str, int] = {}
+        self.extend(comments)
+
+    @classmethod
+    def from_columns(cls, ids: Iterable[int], subreddit_indexes: Iterable[int],
+                     days: Iterable[int], karma: Iterable[int],
+                     subreddits: List[str]) -> CommentHistory:
+        history = cls()
+        history.ids.extend(ids)
+        history.subreddit_indexes.extend(subreddit_indexes)
+        history.days.extend(days)
+        history.karma.extend(karma)
+        history.subreddits = list(subreddits)
+        history._subreddit_lookup = {name: idx for idx, name in enumerate(history.subreddits)}
+        return history
+
+    def _intern(self, subreddit: str) -> int:
+        idx = self._subreddit_lookup.get(subreddit)
+        if idx is None:
+            idx = self._subreddit_lookup[subreddit] = len(self.subreddits)
+            self.subreddits.append(subreddit)
+        return idx
+
+    def append(self, comment: Comment) -> None:
+        self.ids.append(int(comment.id, 36))
+        self.subreddit_indexes.append(self._intern(comment.subreddit))
+        self.days.append(comment.created_at.toordinal() - EPOCH_ORDINAL)
+        self.karma.append(comment.karma)
+
+    def extend(self, comments: Iterable[Comment]) -> None:
+        if isinstance(comments, CommentHistory):
+            self.ids.extend(comments.ids)
+            self.subreddit_indexes.extend(
+                array('I', [self._intern(comments.subreddits[idx])
+                            for idx in comments.subreddit_indexes]))
+            self.days.extend(comments.days)
+            self.karma.extend(comments.karma)
+            return
+        for comment in comments:
+            self.append(comment)
+
+    def since(self, date: datetime.date) -> CommentHistory:
+        """Comments created on or after the given date."""
+        floor = date.toordinal() - EPOCH_ORDINAL
+        keep = [idx for idx, day in enumerate(self.days) if day >= floor]
+        return self._select(keep)
+
+    def id_set(self) -> Set[str]:
+        return {_to_base36(comment_id) for comment_id in self.ids}
+
+    def _select(self, indexes: List[int]) -> CommentHistory:
+        return CommentHistory.from_columns(
+            ids=[self.ids[idx] for idx in indexes],
+            subreddit_indexes=[self.subreddit_indexes[idx] for idx in indexes],
+            days=[self.days[idx] for idx in indexes],
+            karma=[self.karma[idx] for idx in indexes],
+            subreddits=self.subreddits
+        )
+
+    def _row(self, idx: int) -> Comment:
+        return Comment(
+            id=_to_base36(self.ids[idx]),
+            subreddit=self.subreddits[self.subreddit_indexes[idx]],
+            created_at=datetime.date.fromordinal(self.days[idx] + EPOCH_ORDINAL),
+            karma=self.karma[idx]
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[Comment]:
+        for idx in range(len(self.ids)):
+            yield self._row(idx)
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[Comment, CommentHistory]:
+        if isinstance(key, slice):
+            return self._select(list(range(len(self.ids)))[key])
+        if key < 0:
+            key += len(self.ids)
+        if not 0 <= key < len(self.ids):
+            raise IndexError(key)
+        return self._row(key)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, CommentHistory):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return f'CommentHistory({len(self)} comments, {len(self.subreddits)} subreddits)'
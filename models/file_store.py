@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import json
+import os
+from typing import Dict, Iterator, List, Mapping, Optional, Set, Tuple
+
+from models.load_user_settings import LoadUserSettings
+from models.user_data import UserData, UserLoan
+from models.user_data_codec import decode_user_data, encode_user_data, \
+    decode_user_summary, encode_user_summary, decode_load_user_settings, \
+    encode_load_user_settings, decode_loan, encode_loan
+from models.user_summary import UserSummary, summarize
+from util.fs import atomic_write
+
+# Each user is stored in its own file so saving one user never rewrites the others. The index
+# holds a summary of every stored user, full records are only read when a user is opened
+_INDEX_PATH = 'data/index.dat'
+_USERS_DIR = 'data/users'
+
+# Summary changes since the index was written, one JSON line per saved or deleted user. Saving a
+# user appends a line rather than rewriting every summary. Replayed over the index on start and
+# folded into it once it has more lines than the index has users
+_JOURNAL_PATH = 'data/index.journal'
+_JOURNAL_MIN_LINES = 100
+
+_SETTINGS_PATH = 'data/settings.dat'
+
+# Every loan with a redditloans id is stored once in its own file, named by id, and user records
+# reference it. A loan between two stored users is only stored and fetched once. It is deleted
+# with the last stored user referencing it
+_LOANS_DIR = 'data/loans'
+
+# All shared loans in a single file, used before they were stored separately. Split up on first
+# start
+_LEGACY_LOANS_PATH = 'data/loans.dat'
+
+# Single file format used before users were stored separately. Migrated on first start
+_LEGACY_PATH = 'data/save_state.dat'
+
+
+def _user_path(username: str) -> str:
+    return os.path.join(_USERS_DIR, f'{username.lower()}.dat')
+
+
+def _loan_path(loan_id: int) -> str:
+    return os.path.join(_LOANS_DIR, f'{loan_id}.dat')
+
+
+def _read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path, 'r') as file:
+            return json.loads(file.read())
+    except FileNotFoundError:
+        return None
+
+
+def _referenced_loan_ids(record: Optional[dict]) -> Set[int]:
+    # Loans without an id are stored inline in the record
+    if record is None:
+        return set()
+    return {loan for loan in record['loan_history'] if isinstance(loan, int)}
+
+
+class _SharedLoans(Mapping[int, dict]):
+    """Encoded shared loans by id, each read from its file when it is looked up."""
+
+    def __getitem__(self, loan_id: int) -> dict:
+        loan = _read_json(_loan_path(loan_id))
+        if loan is None:
+            raise KeyError(loan_id)
+        return loan
+
+    def __iter__(self) -> Iterator[int]:
+        if not os.path.isdir(_LOANS_DIR):
+            return iter(())
+        # Skips temp files left by an interrupted write
+        return (int(name[:-len('.dat')]) for name in os.listdir(_LOANS_DIR)
+                if name.endswith('.dat') and not name.startswith('.'))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+_shared_loans = _SharedLoans()
+
+
+class FileStore:
+    """Default SaveState backend. JSON files under data/."""
+
+    @staticmethod
+    def exists() -> bool:
+        return os.path.exists(_INDEX_PATH) or os.path.exists(_LEGACY_PATH)
+
+    def load_index(self) -> Tuple[Optional[LoadUserSettings], Dict[str, UserSummary]]:
+        if not os.path.exists(_INDEX_PATH) and os.path.exists(_LEGACY_PATH):
+            return self._migrate_legacy()
+        if os.path.exists(_LEGACY_LOANS_PATH):
+            self._split_legacy_loans()
+
+        load_user_settings = None
+        if os.path.exists(_SETTINGS_PATH):
+            with open(_SETTINGS_PATH, 'r') as file:
+                load_user_settings = decode_load_user_settings(json.loads(file.read()))
+
+        user_summaries = dict()
+        if os.path.exists(_INDEX_PATH):
+            with open(_INDEX_PATH, 'r') as file:
+                json_dict = json.loads(file.read())
+            for value in json_dict.get('users', []):
+                summary = decode_user_summary(value)
+                user_summaries[summary.username] = summary
+
+            # Settings used to be stored in the index
+            if load_user_settings is None and 'load_user_settings' in json_dict:
+                load_user_settings = decode_load_user_settings(json_dict['load_user_settings'])
+                self.save_settings(load_user_settings)
+
+            # Indexes written before summaries were added only list usernames
+            if 'usernames' in json_dict:
+                for username in json_dict['usernames']:
+                    user_summaries[username] = summarize(self.load_user(username))
+                self._write_index(user_summaries)
+
+        lines, complete = self._replay_journal(user_summaries)
+        if not complete or lines > max(_JOURNAL_MIN_LINES, len(user_summaries)):
+            self._write_index(user_summaries)
+
+        return load_user_settings, user_summaries
+
+    @staticmethod
+    def _replay_journal(user_summaries: Dict[str, UserSummary]) -> Tuple[int, bool]:
+        """Apply the journal to the summaries. Returns the number of lines and whether every
+        line could be read."""
+        if not os.path.exists(_JOURNAL_PATH):
+            return 0, True
+
+        lines, complete = 0, True
+        with open(_JOURNAL_PATH, 'r') as file:
+            for line in file:
+                lines += 1
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash. Later lines are still applied and the journal
+                    # is folded into the index so nothing is appended after the broken line
+                    complete = False
+                    continue
+                if 'deleted' in entry:
+                    user_summaries.pop(entry['deleted'], None)
+                else:
+                    summary = decode_user_summary(entry)
+                    user_summaries[summary.username] = summary
+        return lines, complete
+
+    @staticmethod
+    def _append_journal(entry: dict) -> None:
+        os.makedirs(os.path.dirname(_JOURNAL_PATH), exist_ok=True)
+        with open(_JOURNAL_PATH, 'a') as file:
+            file.write(json.dumps(entry) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+    @staticmethod
+    def _write_index(user_summaries: Dict[str, UserSummary]) -> None:
+        # The journal is only dropped once the index holds everything in it. Replaying it over
+        # the new index again after a crash in between gives the same summaries
+        atomic_write(_INDEX_PATH, json.dumps({
+            'users': [encode_user_summary(summary) for summary in user_summaries.values()]
+        }))
+        if os.path.exists(_JOURNAL_PATH):
+            os.remove(_JOURNAL_PATH)
+
+    def _migrate_legacy(self) -> Tuple[Optional[LoadUserSettings], Dict[str, UserSummary]]:
+        load_user_settings = None
+        user_summaries = dict()
+        with open(_LEGACY_PATH, 'r') as file:
+            json_str = file.read()
+            if json_str:
+                json_dict = json.loads(json_str)
+                load_user_settings = decode_load_user_settings(json_dict['load_user_settings'])
+                for value in json_dict.get('user_data', {}).values():
+                    user_data = decode_user_data(value, _shared_loans)
+                    user_summaries[user_data.username] = summarize(user_data)
+                    self.save_user(user_data)
+
+        self.save_settings(load_user_settings or LoadUserSettings(username=''))
+        self._write_index(user_summaries)
+        # Kept rather than deleted in case the migration needs to be redone
+        os.replace(_LEGACY_PATH, f'{_LEGACY_PATH}.bak')
+        return load_user_settings, user_summaries
+
+    @staticmethod
+    def _split_legacy_loans() -> None:
+        with open(_LEGACY_LOANS_PATH, 'r') as file:
+            loans = json.loads(file.read())['loans']
+        # Loans nobody references any more were never deleted from the single file
+        referenced = set()
+        if os.path.isdir(_USERS_DIR):
+            for name in os.listdir(_USERS_DIR):
+                if name.endswith('.dat') and not name.startswith('.'):
+                    referenced |= _referenced_loan_ids(_read_json(os.path.join(_USERS_DIR, name)))
+        # JSON object keys are always strings
+        for loan_id, loan in loans.items():
+            if int(loan_id) in referenced:
+                atomic_write(_loan_path(int(loan_id)), json.dumps(loan))
+        os.replace(_LEGACY_LOANS_PATH, f'{_LEGACY_LOANS_PATH}.bak')
+
+    def save_settings(self, load_user_settings: LoadUserSettings):
+        atomic_write(_SETTINGS_PATH, json.dumps(encode_load_user_settings(load_user_settings)))
+
+    def load_user(self, username: str) -> UserData:
+        with open(_user_path(username), 'r') as file:
+            return decode_user_data(json.loads(file.read()), _shared_loans)
+
+    def save_user(self, user_data: UserData, previous: Optional[UserData] = None):
+        """previous is the user as it was last read or saved, if at hand. Its loans are taken to
+        be stored already rather than reading each loan's file to compare."""
+        stored_ids = _referenced_loan_ids(_read_json(_user_path(user_data.username)))
+        stored_loans = None
+        if previous is not None and previous is not user_data:
+            stored_loans = {loan.loan_id: loan for loan in previous.loan_history
+                            if loan.loan_id in stored_ids}
+
+        # Loans are written before the user so a saved user never references a missing loan. Only
+        # loans that changed are rewritten
+        for loan in user_data.loan_history:
+            if loan.loan_id is None:
+                continue
+            if stored_loans is not None:
+                if stored_loans.get(loan.loan_id) == loan:
+                    continue
+                atomic_write(_loan_path(loan.loan_id), json.dumps(encode_loan(loan)))
+            else:
+                encoded = encode_loan(loan)
+                if _shared_loans.get(loan.loan_id) != encoded:
+                    atomic_write(_loan_path(loan.loan_id), json.dumps(encoded))
+        self.touch_user(user_data)
+        self._prune_loans(user_data.username,
+                          stored_ids - {loan.loan_id for loan in user_data.loan_history})
+
+    def touch_user(self, user_data: UserData):
+        # Writes only the user's record and summary, its loans are left as they are
+        atomic_write(_user_path(user_data.username), json.dumps(encode_user_data(user_data)))
+        self._append_journal(encode_user_summary(summarize(user_data)))
+
+    def get_loan(self, loan_id: int, username: str) -> Optional[UserLoan]:
+        loan = _shared_loans.get(loan_id)
+        return decode_loan(loan, username) if loan is not None else None
+
+    def delete_user(self, username: str):
+        self._append_journal({'deleted': username})
+        record = _read_json(_user_path(username))
+        if record is None:
+            return
+        # The user goes first so a crash in between leaves unreferenced loans rather than a
+        # record referencing missing ones
+        os.remove(_user_path(username))
+        self._prune_loans(username, _referenced_loan_ids(record))
+
+    @staticmethod
+    def _prune_loans(username: str, loan_ids: Set[int]) -> None:
+        """Delete loans a user no longer references that no other stored user references either.
+        Only the other party of a loan can reference it."""
+        username = username.lower()
+        references: Dict[str, Set[int]] = {}
+        for loan_id in loan_ids:
+            loan = _shared_loans.get(loan_id)
+            if loan is None:
+                continue
+            other = loan['borrower'] if loan['lender'].lower() == username else loan['lender']
+            other = other.lower()
+            if other not in references:
+                references[other] = _referenced_loan_ids(_read_json(_user_path(other)))
+            if loan_id not in references[other]:
+                os.remove(_loan_path(loan_id))
+
+    def loans_involving(self, username: str) -> List[UserLoan]:
+        # Reads every shared loan. Loans saved without an id stay inline in their user's record
+        # until the user is loaded again and aren't included
+        username = username.lower()
+        return [decode_loan(loan, username) for loan in _shared_loans.values()
+                if username in (loan['lender'].lower(), loan['borrower'].lower())]
@@ -4,3 +4,7 @@ from dataclasses import dataclass
 @dataclass
 class LoadUserSettings:
     username: str
+
+    # Open the user screen right away and fill in loans as they resolve instead of waiting for the
+    # whole load
+    stream_loans: bool = False
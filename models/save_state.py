@@ -1,20 +1,30 @@
 from __future__ import annotations
 
-import dataclasses
 import datetime
-import json
 import os
-from typing import Dict
-
-from dacite import from_dict, Config
+from collections import OrderedDict
+from typing import Dict, List, Optional, Union
 
+from const import USER_CACHE_SIZE
+from models.file_store import FileStore
 from models.load_user_settings import LoadUserSettings
-from models.user_data import UserData
+from models.sqlite_store import SqliteStore
+from models.user_data import UserData, UserLoan
+from models.user_index import UserIndex
+from models.user_summary import UserSummary, summarize
 
 
 class SaveState:
     load_user_settings: LoadUserSettings
-    user_data: Dict[str, UserData]
+    user_summaries: Dict[str, UserSummary]
+    # The same summaries ordered by last viewed and indexed by username for the home screen
+    user_index: UserIndex
+
+    # Most recently used full user records, bounded by USER_CACHE_SIZE
+    _user_cache: OrderedDict[str, UserData]
+
+    # Storage backend. JSON files by default or SQLite when STORE_BACKEND=sqlite
+    _store: Union[FileStore, SqliteStore]
 
     @classmethod
     def __cls_init__(cls):
@@ -22,34 +32,92 @@ class SaveState:
         cls.load_user_settings = LoadUserSettings(
             username=''
         )
-        cls.user_data = dict()
+        cls.user_summaries = dict()
+        cls._user_cache = OrderedDict()
+
+        if os.getenv('STORE_BACKEND') == 'sqlite':
+            is_new = not SqliteStore.exists()
+            cls._store = SqliteStore()
+            if is_new and FileStore.exists():
+                cls._import_file_store()
+        else:
+            cls._store = FileStore()
 
         # If any saved state exists attempt to overwrite the defaults
-        if not os.path.exists('data/save_state.dat'):
-            return
-
-        with open('data/save_state.dat', 'r') as file:
-            json_str = file.read()
-            dacite_config = Config(type_hooks={
-                datetime.date: lambda x: datetime.datetime.strptime(x, '%Y-%m-%d').date(),
-                datetime.datetime: lambda x: datetime.datetime.strptime(x, '%Y-%m-%d %H:%M:%S.%f')
-            })
-            if json_str:
-                json_dict = json.loads(json_str)
-                SaveState.load_user_settings = from_dict(data_class=LoadUserSettings,
-                                                         data=json_dict['load_user_settings'],
-                                                         config=dacite_config)
-                for key, value in json_dict.get('user_data', {}).items():
-                    SaveState.user_data[key] = from_dict(data_class=UserData, data=value,
-                                                         config=dacite_config)
-
-    @classmethod
-    def save(cls):
-        if not os.path.exists('data'):
-            os.makedirs('data')
-        with open('data/save_state.dat', 'w+') as file:
-            file.write(json.dumps({
-                'load_user_settings': dataclasses.asdict(cls.load_user_settings),
-                'user_data': {key: dataclasses.asdict(value) for key, value in
-                              cls.user_data.items()}
-            }, default=str))
+        load_user_settings, cls.user_summaries = cls._store.load_index()
+        if load_user_settings is not None:
+            cls.load_user_settings = load_user_settings
+        cls.user_index = UserIndex(cls.user_summaries.values())
+
+    @classmethod
+    def _import_file_store(cls):
+        # Carry an existing file cache over the first time the SQLite backend is used
+        file_store = FileStore()
+        load_user_settings, user_summaries = file_store.load_index()
+        for username in user_summaries:
+            cls._store.save_user(file_store.load_user(username))
+        cls._store.save_settings(load_user_settings or cls.load_user_settings)
+
+    @classmethod
+    def get_user(cls, username: str) -> Optional[UserData]:
+        """Full record of a stored user, read from the store if it isn't already cached."""
+        if username not in cls.user_summaries:
+            return None
+
+        user_data = cls._user_cache.get(username)
+        if user_data is None:
+            try:
+                user_data = cls._store.load_user(username)
+            except (OSError, KeyError, TypeError, ValueError):
+                # Unreadable records are dropped so the user can simply be loaded again
+                cls.delete_user(username)
+                return None
+        cls._cache_user(user_data)
+        return user_data
+
+    @classmethod
+    def get_loan(cls, loan_id: int, username: str) -> Optional[UserLoan]:
+        """A stored loan as seen by the given user. Each loan is stored once for every user."""
+        return cls._store.get_loan(loan_id, username)
+
+    @classmethod
+    def loans_involving(cls, username: str) -> List[UserLoan]:
+        """Every stored loan where the user is the lender or borrower, across all cached users."""
+        return cls._store.loans_involving(username)
+
+    @classmethod
+    def save_settings(cls):
+        """Save the load settings."""
+        cls._store.save_settings(cls.load_user_settings)
+
+    @classmethod
+    def save_user(cls, user_data: UserData):
+        """Store a user. Only that user's record and summary are written."""
+        previous = cls._user_cache.get(user_data.username)
+        summary = cls.user_summaries[user_data.username] = summarize(user_data)
+        cls.user_index.put(summary)
+        cls._cache_user(user_data)
+        cls._store.save_user(user_data, previous)
+
+    @classmethod
+    def touch_user(cls, user_data: UserData):
+        """Mark a stored user as viewed now. Only its last viewed time is written."""
+        user_data.last_viewed = datetime.datetime.now()
+        summary = cls.user_summaries[user_data.username] = summarize(user_data)
+        cls.user_index.put(summary)
+        cls._cache_user(user_data)
+        cls._store.touch_user(user_data)
+
+    @classmethod
+    def delete_user(cls, username: str):
+        cls.user_summaries.pop(username)
+        cls.user_index.remove(username)
+        cls._user_cache.pop(username, None)
+        cls._store.delete_user(username)
+
+    @classmethod
+    def _cache_user(cls, user_data: UserData):
+        cls._user_cache[user_data.username] = user_data
+        cls._user_cache.move_to_end(user_data.username)
+        while len(cls._user_cache) > USER_CACHE_SIZE:
+            cls._user_cache.popitem(last=False)
@@ -0,0 +1,406 @@
+from __future__ import annotations
+
+import datetime
+import json
+import os
+import sqlite3
+from typing import Collection, Dict, List, Optional, Tuple
+
+from models.comment_history import CommentHistory
+from models.load_user_settings import LoadUserSettings
+from models.user_data import UserData, UserLoan, LoanRequest, LoanInstallment, Comment
+from models.user_data_codec import decode_load_user_settings, encode_load_user_settings, \
+    decode_activity, encode_activity
+from models.user_summary import UserSummary
+
+_DB_PATH = 'data/save_state.sqlite'
+
+# Bump and add a script to _MIGRATIONS when the table layout changes
+_SCHEMA_VERSION = 4
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    last_load TEXT NOT NULL,
+    last_viewed TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    total_karma INTEGER NOT NULL,
+    comment_karma INTEGER NOT NULL,
+    is_in_usl INTEGER NOT NULL,
+    -- JSON list of the load stages that failed without earlier data to fall back to
+    failed_stages TEXT NOT NULL DEFAULT '[]',
+    -- JSON activity aggregates, encoded like the file store's. Computed on read when NULL
+    activity TEXT
+);
+
+-- Loans with a redditloans id are stored once and shared by every user involved in them
+CREATE TABLE IF NOT EXISTS loans (
+    id INTEGER PRIMARY KEY,
+    loan_id INTEGER,
+    lender TEXT NOT NULL,
+    borrower TEXT NOT NULL,
+    currency_code TEXT NOT NULL,
+    borrow_amount REAL NOT NULL,
+    borrow_date TEXT NOT NULL,
+    repaid_date TEXT,
+    repaid_amount REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS loans_loan_id ON loans (loan_id);
+CREATE INDEX IF NOT EXISTS loans_lender ON loans (lender COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS loans_borrower ON loans (borrower COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS user_loans (
+    username TEXT NOT NULL REFERENCES users (username) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    loan INTEGER NOT NULL REFERENCES loans (id)
+);
+CREATE INDEX IF NOT EXISTS user_loans_username ON user_loans (username, position);
+CREATE INDEX IF NOT EXISTS user_loans_loan ON user_loans (loan);
+
+CREATE TABLE IF NOT EXISTS loan_requests (
+    loan INTEGER PRIMARY KEY REFERENCES loans (id) ON DELETE CASCADE,
+    created_at TEXT NOT NULL,
+    permalink TEXT NOT NULL,
+    post_id TEXT NOT NULL,
+    borrow_amount REAL,
+    payment_types TEXT,
+    repay_amount REAL,
+    repay_date TEXT
+);
+
+CREATE TABLE IF NOT EXISTS loan_installments (
+    loan INTEGER NOT NULL REFERENCES loans (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    repay_amount REAL,
+    repay_date TEXT
+);
+CREATE INDEX IF NOT EXISTS loan_installments_loan ON loan_installments (loan, position);
+
+CREATE TABLE IF NOT EXISTS comments (
+    username TEXT NOT NULL REFERENCES users (username) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    id TEXT NOT NULL,
+    subreddit TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    karma INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS comments_username ON comments (username, position);
+CREATE INDEX IF NOT EXISTS comments_created_at ON comments (created_at);
+'''
+
+# Scripts migrating from the keyed version to the next. Run with foreign keys off
+_MIGRATIONS = {
+    # v2 shares loans between users. Per user rows become user_loans references to a single row per
+    # loan id and the user specific columns are dropped from loans
+    1: '''
+        CREATE TABLE user_loans (
+            username TEXT NOT NULL REFERENCES users (username) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            loan INTEGER NOT NULL REFERENCES loans (id)
+        );
+        INSERT INTO user_loans (username, position, loan)
+        SELECT username, position,
+               COALESCE((SELECT MIN(shared.id) FROM loans shared
+                         WHERE shared.loan_id = loans.loan_id), id)
+        FROM loans;
+
+        DELETE FROM loan_installments WHERE loan NOT IN (SELECT loan FROM user_loans);
+        DELETE FROM loan_requests WHERE loan NOT IN (SELECT loan FROM user_loans);
+        CREATE TABLE loans_v2 (
+            id INTEGER PRIMARY KEY,
+            loan_id INTEGER,
+            lender TEXT NOT NULL,
+            borrower TEXT NOT NULL,
+            currency_code TEXT NOT NULL,
+            borrow_amount REAL NOT NULL,
+            borrow_date TEXT NOT NULL,
+            repaid_date TEXT,
+            repaid_amount REAL NOT NULL
+        );
+        INSERT INTO loans_v2
+        SELECT id, loan_id, lender, borrower, currency_code, borrow_amount, borrow_date,
+               repaid_date, repaid_amount
+        FROM loans WHERE id IN (SELECT loan FROM user_loans);
+        DROP TABLE loans;
+        ALTER TABLE loans_v2 RENAME TO loans;
+
+        CREATE UNIQUE INDEX loans_loan_id ON loans (loan_id);
+        CREATE INDEX loans_lender ON loans (lender COLLATE NOCASE);
+        CREATE INDEX loans_borrower ON loans (borrower COLLATE NOCASE);
+        CREATE INDEX user_loans_username ON user_loans (username, position);
+        CREATE INDEX user_loans_loan ON user_loans (loan);
+    ''',
+    # v3 records the stages that failed to load
+    2: '''
+        ALTER TABLE users ADD COLUMN failed_stages TEXT NOT NULL DEFAULT '[]';
+    ''',
+    # v4 stores activity aggregates. Existing users have them computed on read
+    3: '''
+        ALTER TABLE users ADD COLUMN activity TEXT;
+    ''',
+}
+
+_LOAN_COLUMNS = '''
+    loans.id, loans.loan_id, loans.lender, loans.borrower, loans.currency_code,
+    loans.borrow_amount, loans.borrow_date, loans.repaid_date, loans.repaid_amount,
+    loan_requests.created_at, loan_requests.permalink, loan_requests.post_id,
+    loan_requests.borrow_amount, loan_requests.payment_types, loan_requests.repay_amount,
+    loan_requests.repay_date
+'''
+
+
+def _optional_date(value: Optional[str]) -> Optional[datetime.date]:
+    return datetime.date.fromisoformat(value) if value is not None else None
+
+
+def _optional_str(value) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+class SqliteStore:
+    """
+    Optional SaveState backend. Users, loans and comments are normalized into indexed tables so
+    loading one user or finding every loan involving a username is an indexed query rather than a
+    file parse. WAL mode lets readers run while a user is being written.
+    """
+
+    def __init__(self, path: str = _DB_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('PRAGMA foreign_keys=ON')
+        self._migrate()
+
+    @staticmethod
+    def exists(path: str = _DB_PATH) -> bool:
+        return os.path.exists(path)
+
+    def _migrate(self):
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version == _SCHEMA_VERSION:
+            return
+        if version > _SCHEMA_VERSION:
+            raise sqlite3.DatabaseError(
+                f'Database schema version {version} is newer than {_SCHEMA_VERSION}')
+
+        # Tables are rebuilt by the migrations which foreign keys would cascade through. The pragma
+        # can't change inside a transaction
+        self.connection.execute('PRAGMA foreign_keys=OFF')
+        scripts = [_SCHEMA] if version == 0 else \
+            [_MIGRATIONS[from_version] for from_version in range(version, _SCHEMA_VERSION)]
+        try:
+            # executescript commits first so the transaction is part of the script
+            self.connection.executescript(
+                'BEGIN;' + ''.join(scripts) + f'PRAGMA user_version={_SCHEMA_VERSION}; COMMIT;')
+        except sqlite3.Error:
+            self.connection.rollback()
+            raise
+        finally:
+            self.connection.execute('PRAGMA foreign_keys=ON')
+
+    def load_index(self) -> Tuple[Optional[LoadUserSettings], Dict[str, UserSummary]]:
+        row = self.connection.execute(
+            "SELECT value FROM settings WHERE key = 'load_user_settings'").fetchone()
+        load_user_settings = decode_load_user_settings(json.loads(row[0])) if row else None
+
+        user_summaries = dict()
+        for username, last_load, last_viewed in self.connection.execute(
+                'SELECT username, last_load, last_viewed FROM users'):
+            user_summaries[username] = UserSummary(
+                username=username,
+                last_load=datetime.datetime.fromisoformat(last_load),
+                last_viewed=datetime.datetime.fromisoformat(last_viewed)
+            )
+        return load_user_settings, user_summaries
+
+    def save_settings(self, load_user_settings: LoadUserSettings):
+        # Summaries are columns of the users table and are written along with each user
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES ('load_user_settings', ?)",
+                (json.dumps(encode_load_user_settings(load_user_settings)),))
+
+    def load_user(self, username: str) -> UserData:
+        row = self.connection.execute(
+            'SELECT username, last_load, last_viewed, created_at, total_karma, comment_karma, '
+            'is_in_usl, failed_stages, activity FROM users WHERE username = ?',
+            (username,)).fetchone()
+        if row is None:
+            raise KeyError(username)
+
+        comments = CommentHistory(
+            Comment(id=comment_id, subreddit=subreddit,
+                    created_at=datetime.date.fromisoformat(created_at), karma=karma)
+            for comment_id, subreddit, created_at, karma in self.connection.execute(
+                'SELECT id, subreddit, created_at, karma FROM comments WHERE username = ? '
+                'ORDER BY position', (username,))
+        )
+
+        return UserData(
+            last_load=datetime.datetime.fromisoformat(row[1]),
+            last_viewed=datetime.datetime.fromisoformat(row[2]),
+            username=row[0],
+            created_at=datetime.date.fromisoformat(row[3]),
+            total_karma=row[4],
+            comment_karma=row[5],
+            comments=comments,
+            loan_history=self._query_loans(
+                'JOIN user_loans ON user_loans.loan = loans.id WHERE user_loans.username = ? '
+                'ORDER BY user_loans.position', (username,), username),
+            is_in_usl=bool(row[6]),
+            activity=decode_activity(json.loads(row[8]) if row[8] is not None else None,
+                                     comments),
+            failed_stages=json.loads(row[7])
+        )
+
+    def _query_loans(self, clause: str, params: tuple, username: str) -> List[UserLoan]:
+        # Loans as seen by the given user, clause filters and orders them
+        rows = self.connection.execute(
+            f'SELECT {_LOAN_COLUMNS} FROM loans '
+            f'JOIN loan_requests ON loan_requests.loan = loans.id {clause}', params).fetchall()
+
+        installments: Dict[int, List[LoanInstallment]] = {row[0]: [] for row in rows}
+        if rows:
+            placeholders = ','.join('?' * len(installments))
+            for loan, repay_amount, repay_date in self.connection.execute(
+                    f'SELECT loan, repay_amount, repay_date FROM loan_installments '
+                    f'WHERE loan IN ({placeholders}) ORDER BY loan, position',
+                    tuple(installments)):
+                installments[loan].append(LoanInstallment(repay_amount=repay_amount,
+                                                          repay_date=_optional_date(repay_date)))
+
+        return [
+            UserLoan(
+                lender=row[2],
+                borrower=row[3],
+                currency_code=row[4],
+                borrow_amount=row[5],
+                borrow_date=datetime.date.fromisoformat(row[6]),
+                is_borrower=row[3].lower() == username.lower(),
+                repaid_date=_optional_date(row[7]),
+                repaid_amount=row[8],
+                loan_request=LoanRequest(
+                    created_at=datetime.date.fromisoformat(row[9]),
+                    permalink=row[10],
+                    post_id=row[11],
+                    borrow_amount=row[12],
+                    repay_installments=installments[row[0]],
+                    payment_types=json.loads(row[13]) if row[13] is not None else None,
+                    repay_amount=row[14],
+                    repay_date=_optional_date(row[15])
+                ),
+                loan_id=row[1]
+            )
+            for row in rows
+        ]
+
+    def save_user(self, user_data: UserData, previous: Optional[UserData] = None):
+        # previous isn't needed, loans are compared with their rows as they are updated
+        with self.connection:
+            previous_loans = self._user_loan_rows(user_data.username)
+            # Comments and loan references are removed by the cascade and rewritten. Shared loans
+            # are updated in place
+            self.connection.execute('DELETE FROM users WHERE username = ?',
+                                    (user_data.username,))
+            self.connection.execute(
+                'INSERT INTO users (username, last_load, last_viewed, created_at, total_karma, '
+                'comment_karma, is_in_usl, failed_stages, activity) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (user_data.username, user_data.last_load.isoformat(),
+                 user_data.last_viewed.isoformat(), user_data.created_at.isoformat(),
+                 user_data.total_karma, user_data.comment_karma, int(user_data.is_in_usl),
+                 json.dumps(user_data.failed_stages),
+                 json.dumps(encode_activity(user_data.activity))
+                 if user_data.activity is not None else None))
+
+            self.connection.executemany(
+                'INSERT INTO comments (username, position, id, subreddit, created_at, karma) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(user_data.username, position, comment.id, comment.subreddit,
+                  comment.created_at.isoformat(), comment.karma)
+                 for position, comment in enumerate(user_data.comments)])
+
+            self.connection.executemany(
+                'INSERT INTO user_loans (username, position, loan) VALUES (?, ?, ?)',
+                [(user_data.username, position, self._save_loan(loan))
+                 for position, loan in enumerate(user_data.loan_history)])
+            self._delete_unreferenced_loans(previous_loans)
+
+    def touch_user(self, user_data: UserData):
+        with self.connection:
+            self.connection.execute('UPDATE users SET last_viewed = ? WHERE username = ?',
+                                    (user_data.last_viewed.isoformat(), user_data.username))
+
+    def _save_loan(self, loan: UserLoan) -> int:
+        values = (loan.loan_id, loan.lender, loan.borrower, loan.currency_code, loan.borrow_amount,
+                  loan.borrow_date.isoformat(), _optional_str(loan.repaid_date),
+                  loan.repaid_amount)
+        existing = self.connection.execute(
+            'SELECT id FROM loans WHERE loan_id = ?', (loan.loan_id,)).fetchone() \
+            if loan.loan_id is not None else None
+
+        if existing is None:
+            loan_row = self.connection.execute(
+                'INSERT INTO loans (loan_id, lender, borrower, currency_code, borrow_amount, '
+                'borrow_date, repaid_date, repaid_amount) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                values).lastrowid
+        else:
+            # Updated rather than replaced so other users' references stay valid
+            loan_row = existing[0]
+            self.connection.execute(
+                'UPDATE loans SET loan_id = ?, lender = ?, borrower = ?, currency_code = ?, '
+                'borrow_amount = ?, borrow_date = ?, repaid_date = ?, repaid_amount = ? '
+                'WHERE id = ?', (*values, loan_row))
+            self.connection.execute('DELETE FROM loan_requests WHERE loan = ?', (loan_row,))
+            self.connection.execute('DELETE FROM loan_installments WHERE loan = ?', (loan_row,))
+
+        loan_request = loan.loan_request
+        self.connection.execute(
+            'INSERT INTO loan_requests (loan, created_at, permalink, post_id, borrow_amount, '
+            'payment_types, repay_amount, repay_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (loan_row, loan_request.created_at.isoformat(), loan_request.permalink,
+             loan_request.post_id, loan_request.borrow_amount,
+             json.dumps(loan_request.payment_types)
+             if loan_request.payment_types is not None else None,
+             loan_request.repay_amount, _optional_str(loan_request.repay_date)))
+
+        self.connection.executemany(
+            'INSERT INTO loan_installments (loan, position, repay_amount, repay_date) '
+            'VALUES (?, ?, ?, ?)',
+            [(loan_row, position, installment.repay_amount,
+              _optional_str(installment.repay_date))
+             for position, installment in enumerate(loan_request.repay_installments)])
+        return loan_row
+
+    def _user_loan_rows(self, username: str) -> List[int]:
+        return [row[0] for row in self.connection.execute(
+            'SELECT loan FROM user_loans WHERE username = ?', (username,))]
+
+    def _delete_unreferenced_loans(self, loan_rows: Collection[int]):
+        # Shared loans go with the last user referencing them. Only the loans a user just dropped
+        # are checked rather than the whole table
+        self.connection.executemany(
+            'DELETE FROM loans WHERE id = ? AND NOT EXISTS '
+            '(SELECT 1 FROM user_loans WHERE user_loans.loan = loans.id)',
+            [(loan_row,) for loan_row in set(loan_rows)])
+
+    def delete_user(self, username: str):
+        with self.connection:
+            loan_rows = self._user_loan_rows(username)
+            self.connection.execute('DELETE FROM users WHERE username = ?', (username,))
+            self._delete_unreferenced_loans(loan_rows)
+
+    def get_loan(self, loan_id: int, username: str) -> Optional[UserLoan]:
+        loans = self._query_loans('WHERE loans.loan_id = ?', (loan_id,), username)
+        return loans[0] if loans else None
+
+    def loans_involving(self, username: str) -> List[UserLoan]:
+        return self._query_loans(
+            'WHERE loans.lender = ?1 COLLATE NOCASE OR loans.borrower = ?1 COLLATE NOCASE '
+            'ORDER BY loans.borrow_date', (username,), username)
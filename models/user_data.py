@@ -1,6 +1,10 @@
 import datetime
-from dataclasses import dataclass
-from typing import List, Optional
+from dataclasses import dataclass, field
+from typing import List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from models.activity_aggregates import ActivityAggregates
+    from models.comment_history import CommentHistory
 
 
 @dataclass
@@ -44,9 +48,15 @@ class UserLoan:
     # The details of the loan are the source of truth but may differ from the original request
     loan_request: LoanRequest
 
+    # redditloans loan id. None for loans saved before ids were recorded
+    loan_id: Optional[int] = None
+
 
 @dataclass
 class Comment:
+    # Comments are stored columnar in CommentHistory and built on demand when iterated
+    __slots__ = ('id', 'subreddit', 'created_at', 'karma')
+
     id: str
     subreddit: str
     created_at: datetime.date
@@ -63,8 +73,15 @@ class UserData:
     total_karma: int
     comment_karma: int
 
-    comments: List[Comment]
+    comments: 'CommentHistory'
     loan_history: List[UserLoan]
 
     # If the user is in the universal scammer list
     is_in_usl: bool
+
+    # Derived from comments when the user is loaded
+    activity: Optional['ActivityAggregates'] = None
+
+    # Load stages that failed without earlier data to fall back to. Their fields are placeholders,
+    # e.g. an empty loan history, not what the user actually has
+    failed_stages: List[str] = field(default_factory=list)
@@ -0,0 +1,262 @@
+import datetime
+from array import array
+from typing import Callable, Dict, Mapping, Optional
+
+from models.activity_aggregates import ActivityAggregates
+from models.comment_history import CommentHistory
+from models.load_user_settings import LoadUserSettings
+from models.user_data import UserData, UserLoan, LoanRequest, LoanInstallment, Comment
+from models.user_summary import UserSummary
+
+# Hand written (de)serialization for the saved models. Replaces dacite's reflective decoding which
+# type checks every field of every comment and loan.
+#
+# Bump SCHEMA_VERSION whenever the saved shape changes and add a migration from the previous
+# version to _MIGRATIONS so existing caches keep loading.
+SCHEMA_VERSION = 6
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def _migrate_v1(data: dict) -> dict:
+    # v1 records were written with dataclasses.asdict and have no schema_version. Dates are already
+    # in a format fromisoformat reads and loan_id is optional, so only the version is missing
+    return data
+
+
+def _migrate_v2(data: dict) -> dict:
+    # v3 stores comments columnar rather than as a list of objects
+    comments = CommentHistory()
+    for comment in data['comments']:
+        comments.append(Comment(
+            id=comment['id'],
+            subreddit=comment['subreddit'],
+            created_at=datetime.date.fromisoformat(comment['created_at']),
+            karma=comment['karma']
+        ))
+    data['comments'] = _encode_comments(comments)
+    return data
+
+
+def _migrate_v3(data: dict) -> dict:
+    # v4 stores activity aggregates. Older records have them computed on decode
+    data['activity'] = None
+    return data
+
+
+def _migrate_v4(data: dict) -> dict:
+    # v5 stores loans with an id once in the shared loan store and the history only references
+    # them. Inline loans are still read, they are moved to the shared store the next time the user
+    # is saved
+    return data
+
+
+def _migrate_v5(data: dict) -> dict:
+    # v6 records the stages that failed to load. Older records didn't track them
+    data['failed_stages'] = []
+    return data
+
+
+_MIGRATIONS: Dict[int, Callable[[dict], dict]] = {
+    1: _migrate_v1,
+    2: _migrate_v2,
+    3: _migrate_v3,
+    4: _migrate_v4,
+    5: _migrate_v5,
+}
+
+
+def _migrate(data: dict) -> dict:
+    version = data.get('schema_version', 1)
+    if version > SCHEMA_VERSION:
+        raise SchemaError(f'Saved schema version {version} is newer than {SCHEMA_VERSION}')
+    while version < SCHEMA_VERSION:
+        data = _MIGRATIONS[version](data)
+        version += 1
+    return data
+
+
+def _optional_date(value: Optional[str]) -> Optional[datetime.date]:
+    return datetime.date.fromisoformat(value) if value is not None else None
+
+
+def _optional_str(value) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def decode_loan(data: dict, username: str) -> UserLoan:
+    """Decode a loan as seen by one of the users involved in it."""
+    loan_request = data['loan_request']
+    return UserLoan(
+        lender=data['lender'],
+        borrower=data['borrower'],
+        currency_code=data['currency_code'],
+        borrow_amount=data['borrow_amount'],
+        borrow_date=datetime.date.fromisoformat(data['borrow_date']),
+        is_borrower=data['borrower'].lower() == username.lower(),
+        repaid_date=_optional_date(data['repaid_date']),
+        repaid_amount=data['repaid_amount'],
+        loan_request=LoanRequest(
+            created_at=datetime.date.fromisoformat(loan_request['created_at']),
+            permalink=loan_request['permalink'],
+            post_id=loan_request['post_id'],
+            borrow_amount=loan_request['borrow_amount'],
+            repay_installments=[
+                LoanInstallment(
+                    repay_amount=installment['repay_amount'],
+                    repay_date=_optional_date(installment['repay_date'])
+                )
+                for installment in loan_request['repay_installments']
+            ],
+            payment_types=loan_request['payment_types'],
+            repay_amount=loan_request['repay_amount'],
+            repay_date=_optional_date(loan_request['repay_date'])
+        ),
+        loan_id=data.get('loan_id')
+    )
+
+
+def encode_loan(loan: UserLoan) -> dict:
+    """Encode a loan independent of which user it was loaded for."""
+    loan_request = loan.loan_request
+    return {
+        'lender': loan.lender,
+        'borrower': loan.borrower,
+        'currency_code': loan.currency_code,
+        'borrow_amount': loan.borrow_amount,
+        'borrow_date': loan.borrow_date.isoformat(),
+        'repaid_date': _optional_str(loan.repaid_date),
+        'repaid_amount': loan.repaid_amount,
+        'loan_request': {
+            'created_at': loan_request.created_at.isoformat(),
+            'permalink': loan_request.permalink,
+            'post_id': loan_request.post_id,
+            'borrow_amount': loan_request.borrow_amount,
+            'repay_installments': [
+                {
+                    'repay_amount': installment.repay_amount,
+                    'repay_date': _optional_str(installment.repay_date)
+                }
+                for installment in loan_request.repay_installments
+            ],
+            'payment_types': loan_request.payment_types,
+            'repay_amount': loan_request.repay_amount,
+            'repay_date': _optional_str(loan_request.repay_date)
+        },
+        'loan_id': loan.loan_id
+    }
+
+
+def _decode_comments(data: dict) -> CommentHistory:
+    return CommentHistory.from_columns(
+        ids=data['ids'],
+        subreddit_indexes=data['subreddit_indexes'],
+        days=data['days'],
+        karma=data['karma'],
+        subreddits=data['subreddits']
+    )
+
+
+def _encode_comments(comments: CommentHistory) -> dict:
+    return {
+        'ids': comments.ids.tolist(),
+        'subreddit_indexes': comments.subreddit_indexes.tolist(),
+        'days': comments.days.tolist(),
+        'karma': comments.karma.tolist(),
+        'subreddits': comments.subreddits
+    }
+
+
+def decode_activity(data: Optional[dict], comments: CommentHistory) -> ActivityAggregates:
+    if data is None:
+        return ActivityAggregates.from_comments(comments)
+    return ActivityAggregates(
+        first_day=data['first_day'],
+        daily_counts=array('I', data['daily_counts']),
+        subreddits=[(name, count, karma) for name, count, karma in data['subreddits']]
+    )
+
+
+def encode_activity(activity: Optional[ActivityAggregates]) -> Optional[dict]:
+    if activity is None:
+        return None
+    return {
+        'first_day': activity.first_day,
+        'daily_counts': activity.daily_counts.tolist(),
+        'subreddits': activity.subreddits
+    }
+
+
+def decode_user_data(data: dict, shared_loans: Mapping[int, dict]) -> UserData:
+    """Decode a user. Loan history entries that are loan ids are read from shared_loans."""
+    data = _migrate(data)
+    comments = _decode_comments(data['comments'])
+    username = data['username']
+
+    return UserData(
+        last_load=datetime.datetime.fromisoformat(data['last_load']),
+        last_viewed=datetime.datetime.fromisoformat(data['last_viewed']),
+        username=username,
+        created_at=datetime.date.fromisoformat(data['created_at']),
+        total_karma=data['total_karma'],
+        comment_karma=data['comment_karma'],
+        comments=comments,
+        loan_history=[
+            decode_loan(shared_loans[loan] if isinstance(loan, int) else loan, username)
+            for loan in data['loan_history']
+        ],
+        is_in_usl=data['is_in_usl'],
+        activity=decode_activity(data['activity'], comments),
+        failed_stages=data['failed_stages']
+    )
+
+
+def encode_user_data(user_data: UserData) -> dict:
+    """Encode a user. Loans with an id are referenced by id and must be saved with encode_loan."""
+    return {
+        'schema_version': SCHEMA_VERSION,
+        'last_load': user_data.last_load.isoformat(),
+        'last_viewed': user_data.last_viewed.isoformat(),
+        'username': user_data.username,
+        'created_at': user_data.created_at.isoformat(),
+        'total_karma': user_data.total_karma,
+        'comment_karma': user_data.comment_karma,
+        'comments': _encode_comments(user_data.comments),
+        'loan_history': [loan.loan_id if loan.loan_id is not None else encode_loan(loan)
+                         for loan in user_data.loan_history],
+        'is_in_usl': user_data.is_in_usl,
+        'activity': encode_activity(user_data.activity),
+        'failed_stages': user_data.failed_stages
+    }
+
+
+def decode_user_summary(data: dict) -> UserSummary:
+    return UserSummary(
+        username=data['username'],
+        last_load=datetime.datetime.fromisoformat(data['last_load']),
+        last_viewed=datetime.datetime.fromisoformat(data['last_viewed'])
+    )
+
+
+def encode_user_summary(summary: UserSummary) -> dict:
+    return {
+        'username': summary.username,
+        'last_load': summary.last_load.isoformat(),
+        'last_viewed': summary.last_viewed.isoformat()
+    }
+
+
+def decode_load_user_settings(data: dict) -> LoadUserSettings:
+    return LoadUserSettings(
+        username=data['username'],
+        stream_loans=data.get('stream_loans', False)
+    )
+
+
+def encode_load_user_settings(load_user_settings: LoadUserSettings) -> dict:
+    return {
+        'username': load_user_settings.username,
+        'stream_loans': load_user_settings.stream_loans
+    }
@@ -0,0 +1,69 @@
+import bisect
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from models.user_summary import UserSummary
+
+
+def _recency_key(summary: UserSummary) -> Tuple[float, str]:
+    return -summary.last_viewed.timestamp(), summary.username
+
+
+def _name_key(summary: UserSummary) -> Tuple[str, str]:
+    return summary.username.lower(), summary.username
+
+
+class UserIndex:
+    """
+    Cached users kept in last viewed order, plus a sorted username index for prefix search. Both
+    are updated as users are saved and deleted so listing users never re-sorts every summary.
+    """
+
+    def __init__(self, summaries: Iterable[UserSummary] = ()):
+        self._summaries: Dict[str, UserSummary] = {summary.username: summary for summary in summaries}
+        self._recent = sorted(_recency_key(summary) for summary in self._summaries.values())
+        self._names = sorted(_name_key(summary) for summary in self._summaries.values())
+
+    def __len__(self) -> int:
+        return len(self._summaries)
+
+    def put(self, summary: UserSummary) -> None:
+        previous = self._summaries.get(summary.username)
+        if previous is not None:
+            if _recency_key(previous) == _recency_key(summary):
+                self._summaries[summary.username] = summary
+                return
+            self._remove_key(self._recent, _recency_key(previous))
+        else:
+            bisect.insort(self._names, _name_key(summary))
+        self._summaries[summary.username] = summary
+        bisect.insort(self._recent, _recency_key(summary))
+
+    def remove(self, username: str) -> None:
+        summary = self._summaries.pop(username, None)
+        if summary is not None:
+            self._remove_key(self._recent, _recency_key(summary))
+            self._remove_key(self._names, _name_key(summary))
+
+    @staticmethod
+    def _remove_key(keys: list, key) -> None:
+        index = bisect.bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            del keys[index]
+
+    def recent(self, limit: Optional[int] = None) -> List[UserSummary]:
+        """Users by last viewed, most recent first."""
+        keys = self._recent if limit is None else self._recent[:limit]
+        return [self._summaries[username] for _, username in keys]
+
+    def search(self, prefix: str, limit: Optional[int] = None) -> Tuple[List[UserSummary], int]:
+        """Users whose name starts with prefix, ignoring case, by last viewed. Also returns the
+        total number of matches."""
+        if not prefix:
+            return self.recent(limit), len(self)
+
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self._names, (prefix,))
+        end = bisect.bisect_left(self._names, (prefix + '\uffff',), lo=start)
+        matches = sorted((self._summaries[username] for _, username in self._names[start:end]),
+                         key=_recency_key)
+        return matches[:limit], len(matches)
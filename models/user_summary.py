@@ -0,0 +1,20 @@
+import datetime
+from dataclasses import dataclass
+
+from models.user_data import UserData
+
+
+@dataclass
+class UserSummary:
+    """The fields of a cached user needed to list it without loading the full record."""
+    username: str
+    last_load: datetime.datetime
+    last_viewed: datetime.datetime
+
+
+def summarize(user_data: UserData) -> UserSummary:
+    return UserSummary(
+        username=user_data.username,
+        last_load=user_data.last_load,
+        last_viewed=user_data.last_viewed
+    )
@@ -0,0 +1,36 @@
+import datetime
+from dataclasses import dataclass
+from typing import List, Optional
+
+from const import MIN_AGE_DAYS, MIN_COMMENT_KARMA, MIN_KARMA
+from models.user_data import UserData
+
+
+def account_age_days(user_data: UserData, today: Optional[datetime.date] = None) -> int:
+    return ((today or datetime.date.today()) - user_data.created_at).days
+
+
+@dataclass
+class RedFlags:
+    """Lending requirements a user fails. Shared by the user info tab and the vetting CLI."""
+    account_age: bool
+    total_karma: bool
+    comment_karma: bool
+    in_usl: bool
+
+    @classmethod
+    def check(cls, user_data: UserData, today: Optional[datetime.date] = None) -> 'RedFlags':
+        # Requirements that couldn't be checked are flagged
+        info_missing = 'user info' in user_data.failed_stages
+        return cls(
+            account_age=info_missing or account_age_days(user_data, today) < MIN_AGE_DAYS,
+            total_karma=info_missing or user_data.total_karma < MIN_KARMA,
+            comment_karma=info_missing or user_data.comment_karma < MIN_COMMENT_KARMA,
+            in_usl=user_data.is_in_usl or 'USL status' in user_data.failed_stages
+        )
+
+    def names(self) -> List[str]:
+        return [name for name, flagged in vars(self).items() if flagged]
+
+    def __bool__(self) -> bool:
+        return any(vars(self).values())
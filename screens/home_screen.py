@@ -1,22 +1,49 @@
 import datetime
-import time
+from typing import List
 
-import arrow
 from textual.app import ComposeResult
 from textual.binding import Binding
 from textual.containers import Horizontal
 from textual.events import ScreenResume
 from textual.screen import Screen
 from textual.validation import Function
-from textual.widgets import Footer, Button, Static, Input, Rule, Label, ListView, ListItem
+from textual.widgets import Footer, Button, Static, Input, Rule, Label, ListView, ListItem, \
+    Checkbox
 
+from const import HOME_USER_LIST_LIMIT
 from models.save_state import SaveState
 from models.user_data import UserData
+from models.user_summary import UserSummary
 from screens.load_user_screen import LoadUserScreen
 from screens.user_screen import UserScreen
 from util.date import humanize
 
 
+class CachedUserItem(ListItem):
+    """A row of the cached user list. Rows are reused as the list changes and only relabelled
+    where what they show changed."""
+
+    def __init__(self, summary: UserSummary) -> None:
+        super().__init__(classes='cached_user_row')
+        self.username = ''
+        self._labels = (Label(), Label(), Label())
+        self._shown = ('', '', '')
+        self._delete_button = Button('Delete', classes='compact')
+        for label in self._labels:
+            self.compose_add_child(label)
+        self.compose_add_child(self._delete_button)
+        self.show(summary)
+
+    def show(self, summary: UserSummary) -> None:
+        self.username = summary.username
+        self._delete_button.action = f"screen.handle_delete_user('{summary.username}')"
+        shown = (summary.username, humanize(summary.last_load), humanize(summary.last_viewed))
+        for label, text, previous in zip(self._labels, shown, self._shown):
+            if text != previous:
+                label.update(text)
+        self._shown = shown
+
+
 class HomeScreen(Screen):
     BINDINGS = [
         Binding(key="escape", action="quit", description="Quit"),
@@ -24,6 +51,11 @@ class HomeScreen(Screen):
         Binding("backspace", "handle_delete", "Delete", show=False),
     ]
 
+    def __init__(self) -> None:
+        # Rows currently in the cached user list, in display order
+        self._user_rows: List[CachedUserItem] = []
+        super().__init__()
+
     def compose(self) -> ComposeResult:
         load_user_settings = SaveState.load_user_settings
 
@@ -40,15 +72,18 @@ class HomeScreen(Screen):
                     ],
                 )
                 yield Button(id='load_button', label='Load', action='screen.load_user')
+                yield Checkbox('Stream loans', id='stream_loans_checkbox',
+                               value=load_user_settings.stream_loans)
 
         yield Rule()
 
         # Recently Loaded/Cached User Table
 
         with Static(classes='ghostpanel'):
-            yield Label('Cached Users (by last viewed).')
+            yield Label('Cached Users (by last viewed). Type in the username box to filter.')
             yield Label(
                 'Use [↑][↓] to select a user. Use [Enter] to view or [Backspace ←] to delete.')
+            yield Label('', id='cached_user_count')
 
         with Static(classes='panel'):
             with Static(classes='cached_user_row'):
@@ -66,26 +101,35 @@ class HomeScreen(Screen):
         # this screen
         self._refresh_user_list()
 
-    @property
-    def recent_users(self):
-        users = list(SaveState.user_data.values())
-        users.sort(key=lambda u: u.last_viewed, reverse=True)
-        return users
+    def on_user_screen_stream_finished(self, event_: UserScreen.StreamFinished):
+        self._refresh_user_list()
+
+    def on_input_changed(self, event: Input.Changed):
+        if event.input.id == 'username_input':
+            self._refresh_user_list()
 
     def _action_handle_delete(self):
-        cached_user_list = self.query_one(ListView)
-        self._action_handle_delete_index(cached_user_list.index)
+        selected_item = self.query_one(ListView).highlighted_child
+        if isinstance(selected_item, CachedUserItem):
+            self._action_handle_delete_user(selected_item.username)
 
-    def _action_handle_delete_index(self, idx):
-        selected_user = self.recent_users[idx]
-        SaveState.user_data.pop(selected_user.username)
-        SaveState.save()
+    def _action_handle_delete_user(self, username: str):
+        if username in SaveState.user_summaries:
+            SaveState.delete_user(username)
         self._refresh_user_list()
 
-    def on_list_view_selected(self, _event):
-        cached_user_list = self.query_one(ListView)
-        selected_user = self.recent_users[cached_user_list.index]
-        self._handle_load_user_result(selected_user)
+    def on_list_view_selected(self, event: ListView.Selected):
+        username = event.item.username
+        user_data = SaveState.get_user(username)
+        if user_data is None:
+            self.notify(f'Cached data for {username} could not be read', severity='error')
+            self._refresh_user_list()
+            return
+        self._show_stored_user(user_data)
+
+    def on_checkbox_changed(self, event: Checkbox.Changed):
+        SaveState.load_user_settings.stream_loans = event.value
+        SaveState.save_settings()
 
     def _action_quit(self):
         self.app.exit()
@@ -101,29 +145,55 @@ class HomeScreen(Screen):
 
         load_user_settings = SaveState.load_user_settings
         load_user_settings.username = username
-        SaveState.save()
+        SaveState.save_settings()
+
+        if UserScreen.is_streaming(username):
+            # Its first load is still running after its screen was closed
+            self.notify(f'{username} is still loading')
+            return
 
-        if username in SaveState.user_data:
+        user_data = SaveState.get_user(username)
+        if user_data is not None:
             # We already have data loaded for this user. We can skip loading it
-            self._handle_load_user_result(SaveState.user_data[username])
+            self._show_stored_user(user_data)
+        elif load_user_settings.stream_loans:
+            # The user screen loads and saves the user itself, even if it is closed first
+            self.app.push_screen(UserScreen.streaming(username))
         else:
             self.app.push_screen(LoadUserScreen(load_user_settings), self._handle_load_user_result)
 
+    def _show_stored_user(self, user_data: UserData) -> None:
+        # Nothing but the last viewed time changed, the rest of the record isn't rewritten
+        SaveState.touch_user(user_data)
+        self._refresh_user_list()
+        self.app.push_screen(UserScreen(user_data))
+
     def _handle_load_user_result(self, user_data: UserData) -> None:
-        SaveState.user_data[user_data.username] = user_data
         user_data.last_viewed = datetime.datetime.now()
-        SaveState.save()
+        SaveState.save_user(user_data)
         self._refresh_user_list()
         self.app.push_screen(UserScreen(user_data))
 
     def _refresh_user_list(self):
+        # Users matching the username typed so far, by last viewed. Existing rows are relabelled
+        # in place and rows are only mounted or removed when the number of matches changes
+        query = self.query_one('#username_input', Input).value.strip()
+        if query == SaveState.load_user_settings.username:
+            # The box is pre-filled with the last loaded user, which isn't a search
+            query = ''
+        summaries, total = SaveState.user_index.search(query, HOME_USER_LIST_LIMIT)
+
         user_list = self.query_one('#cached_user_list', ListView)
-        user_list.clear()
-        for (idx, user) in enumerate(self.recent_users):
-            list_item = ListItem(classes='cached_user_row')
-            list_item.compose_add_child(Label(user.username))
-            list_item.compose_add_child(Label(humanize(user.last_load)))
-            list_item.compose_add_child(Label(humanize(user.last_viewed)))
-            list_item.compose_add_child(
-                Button('Delete', classes='compact', action=f'screen.handle_delete_index({idx})'))
-            user_list.append(list_item)
+        rows = self._user_rows
+        for row, summary in zip(rows, summaries):
+            row.show(summary)
+        if len(summaries) > len(rows):
+            added = [CachedUserItem(summary) for summary in summaries[len(rows):]]
+            rows.extend(added)
+            user_list.extend(added)
+        elif len(summaries) < len(rows):
+            user_list.remove_items(range(len(summaries), len(rows)))
+            del rows[len(summaries):]
+
+        self.query_one('#cached_user_count', Label).update(
+            f'Showing {len(summaries)} of {total} matching users' if total > len(summaries) else '')
@@ -1,34 +1,83 @@
-from datetime import datetime
+import datetime
+from typing import List, Set
 
 from textual.app import ComposeResult
 from textual.binding import Binding
 from textual.containers import Horizontal, Vertical
+from textual.message import Message
 from textual.screen import Screen
 from textual.widgets import Footer, Button, ContentSwitcher, Label, Rule, Static
 
+from ai.extraction_cache import ExtractionCache
+from const import UI_MAX_FPS
+from models.comment_history import CommentHistory
 from models.save_state import SaveState
-from models.user_data import UserData
+from models.user_data import UserData, UserLoan
 from screens.load_user_screen import LoadUserScreen
+from services.user_loader import UserLoader
 from util.date import humanize
+from util.throttle import Throttle
+from util.tracing import Tracer
 from widgets.loan_history_widget import LoanHistoryWidget
 from widgets.reddit_activity_widget import RedditActivityWidget
+from widgets.trace_summary_widget import TraceSummaryWidget
 from widgets.user_info_widget import UserInfoWidget
 
-# Requirements
-_MIN_KARMA = 2000
-_MIN_COMMENT_KARMA = 800
-_MIN_AGE_DAYS = 120
-
 
 class UserScreen(Screen):
     BINDINGS = [
         Binding(key='escape', action='go_back', description='Go back'),
     ]
 
-    def __init__(self, user_data: UserData) -> None:
+    class LoansResolved(Message):
+        def __init__(self, loans: List[UserLoan]) -> None:
+            self.loans = loans
+            super().__init__()
+
+    class Loaded(Message):
+        def __init__(self, user_data: UserData) -> None:
+            self.user_data = user_data
+            super().__init__()
+
+    class StreamFinished(Message):
+        """A streamed load saved its user after the screen showing it was closed."""
+
+        def __init__(self, username: str) -> None:
+            self.username = username
+            super().__init__()
+
+    # Users being streamed in, lowercased. Loads outlive their screen so a second one could be
+    # started for the same user and race it to the save
+    _streaming: Set[str] = set()
+
+    def __init__(self, user_data: UserData, is_loading: bool = False) -> None:
         self.user_data = user_data
+        # While loading user_data is a placeholder whose loan history fills in as loans resolve
+        self.is_loading = is_loading
+        self._current_tab = 'loan_history' if is_loading else 'user_info'
         super().__init__()
 
+    @classmethod
+    def streaming(cls, username: str) -> 'UserScreen':
+        """Open a user that hasn't been loaded yet and stream its loans in while it loads."""
+        now = datetime.datetime.now()
+        placeholder = UserData(
+            last_load=now,
+            last_viewed=now,
+            username=username,
+            created_at=now.date(),
+            total_karma=0,
+            comment_karma=0,
+            comments=CommentHistory(),
+            loan_history=[],
+            is_in_usl=False
+        )
+        return cls(placeholder, is_loading=True)
+
+    @classmethod
+    def is_streaming(cls, username: str) -> bool:
+        return username.lower() in cls._streaming
+
     def compose(self) -> ComposeResult:
         with Vertical(classes='header'):
             with Horizontal(classes='ghostpanel autoheight'):
@@ -37,9 +86,16 @@ class UserScreen(Screen):
                     yield Label(self.user_data.username)
                 with Vertical(classes='autoheight'):
                     yield Label('Last Data Fetch')
-                    yield Label(humanize(self.user_data.last_load))
+                    yield Label('Loading...' if self.is_loading else
+                                humanize(self.user_data.last_load))
                 with Vertical(classes='autoheight'):
-                    yield Button('Refresh', classes='compact', action='screen.refresh_user')
+                    yield Button('Refresh', classes='compact', action='screen.refresh_user',
+                                 disabled=self.is_loading)
+
+            if self.user_data.failed_stages:
+                yield Label(f'Failed to load {", ".join(self.user_data.failed_stages)}. '
+                            f'Their data is missing, refresh to try again',
+                            id='failed_stages', classes='ghostpanel')
 
             yield Rule()
 
@@ -47,28 +103,94 @@ class UserScreen(Screen):
                 yield Button('User Info', id='user_info')
                 yield Button('Reddit Activity', id='reddit_activity')
                 yield Button('Loan History', id='loan_history')
-
-            with ContentSwitcher(id='user_screen_content', initial='user_info', classes='panel'):
-                yield UserInfoWidget(id='user_info', user_data=self.user_data)
-                yield RedditActivityWidget(id='reddit_activity', user_data=self.user_data)
+                if Tracer.enabled:
+                    yield Button('Trace', id='trace')
+
+            with ContentSwitcher(id='user_screen_content', initial=self._current_tab,
+                                 classes='panel'):
+                if self.is_loading:
+                    yield Label('Loading...', id='user_info')
+                    yield Label('Loading...', id='reddit_activity')
+                else:
+                    yield UserInfoWidget(id='user_info', user_data=self.user_data)
+                    yield RedditActivityWidget(id='reddit_activity', user_data=self.user_data)
                 yield LoanHistoryWidget(id='loan_history', user_data=self.user_data)
+                if Tracer.enabled:
+                    if self.is_loading:
+                        yield Label('Loading...', id='trace')
+                    else:
+                        yield TraceSummaryWidget(id='trace', username=self.user_data.username)
 
         yield Footer(show_command_palette=False)
 
+    def on_mount(self) -> None:
+        if self.is_loading:
+            # Loans are added to the table in batches, at most once a frame
+            self._pending_loans: List[UserLoan] = []
+            self._loan_throttle = Throttle(1 / UI_MAX_FPS, self._post_loans)
+            # Run by the app so going back doesn't cancel the load. The user is still saved and
+            # shows up in the home screen's list once it finishes
+            UserScreen._streaming.add(self.user_data.username.lower())
+            self.app.run_worker(self._stream_user())
+
     def on_button_pressed(self, event: Button.Pressed) -> None:
+        self._current_tab = event.button.id
         self.query_one(ContentSwitcher).current = event.button.id
 
+    async def _stream_user(self) -> None:
+        loader = UserLoader(
+            self.user_data.username,
+            on_error=lambda message: self.app.notify(message, severity='error'),
+            on_loan=self._queue_loan,
+            log=self.app.log
+        )
+        try:
+            user_data = await loader.load()
+            SaveState.save_user(user_data)
+        finally:
+            ExtractionCache.save()
+            UserScreen._streaming.discard(self.user_data.username.lower())
+        if self.is_attached:
+            self._loan_throttle.flush_now()
+            self.post_message(self.Loaded(user_data))
+        else:
+            self.app.notify(f'Finished loading {user_data.username}')
+            # Only the home screen acts on it, any other screen on top lets it bubble up to the
+            # app unhandled. The home screen refreshes its list once it's shown again anyway
+            self.app.screen.post_message(self.StreamFinished(user_data.username))
+
+    def _queue_loan(self, loan: UserLoan) -> None:
+        self._pending_loans.append(loan)
+        self._loan_throttle.schedule()
+
+    def _post_loans(self) -> None:
+        self.post_message(self.LoansResolved(self._pending_loans))
+        self._pending_loans = []
+
+    def on_user_screen_loans_resolved(self, message: LoansResolved) -> None:
+        self.query_one(LoanHistoryWidget).add_loans(message.loans)
+
+    def on_user_screen_loaded(self, message: Loaded) -> None:
+        if message.user_data.username != self.user_data.username:
+            return
+        self.user_data = message.user_data
+        self.is_loading = False
+        self.refresh(recompose=True)
+
     def _action_refresh_user(self):
+        if self.is_loading:
+            return
+
         username = self.user_data.username
 
         load_user_settings = SaveState.load_user_settings
         load_user_settings.username = username
 
-        self.app.push_screen(LoadUserScreen(load_user_settings), self._handle_refresh_user_result)
+        self.app.push_screen(LoadUserScreen(load_user_settings, previous_user_data=self.user_data),
+                             self._handle_refresh_user_result)
 
     def _handle_refresh_user_result(self, user_data: UserData) -> None:
-        SaveState.user_data[user_data.username] = user_data
-        SaveState.save()
+        SaveState.save_user(user_data)
         self.user_data = user_data
         self.refresh(recompose=True)
 
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import json
+import time
+from typing import Any, Callable, Collection, Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from const import HTTP_MAX_CONNECTIONS, HTTP_MAX_CONNECTIONS_PER_HOST, HTTP_KEEPALIVE_SECONDS, \
+    HTTP_TIMEOUT_SECONDS
+from services.rate_limiter import RateLimiter
+from services.response_cache import ResponseCache
+from util.tracing import Tracer
+
+# Seconds a response may be served from the cache. Either fixed or computed from the decoded
+# response, e.g. forever for a repaid loan but minutes for an unpaid one
+Ttl = Union[float, Callable[[Any], float]]
+
+
+class HttpClient:
+    """
+    App wide HTTP client. All outbound (non-praw) requests go through a single pooled session so
+    connections and TLS sessions are reused between requests instead of being re-established for
+    every loan. Requests are paced per host and retried by the RateLimiter.
+    """
+    _session: Optional[aiohttp.ClientSession] = None
+
+    @classmethod
+    def session(cls) -> aiohttp.ClientSession:
+        # The session is created lazily because it must be bound to the running event loop
+        if cls._session is None or cls._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_MAX_CONNECTIONS,
+                limit_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,
+                keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+                ttl_dns_cache=300,
+            )
+            cls._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SECONDS),
+            )
+        return cls._session
+
+    @classmethod
+    async def get_json(cls, url: str, headers: Optional[Dict[str, str]] = None,
+                       ttl: Optional[Ttl] = None) -> Any:
+        """GET a JSON response. Successful responses are cached when a ttl is given."""
+        with Tracer.span(urlsplit(url).netloc, 'http', url=url):
+            if ttl is None:
+                async with await cls._send(url, headers) as res:
+                    Tracer.annotate(bytes=len(await res.read()))
+                    return await res.json()
+            _, value = await cls._get_cached(url, headers, ttl, json.loads, cacheable=(200,))
+            return value
+
+    @classmethod
+    async def get_status(cls, url: str, headers: Optional[Dict[str, str]] = None,
+                         ttl: Optional[Ttl] = None) -> int:
+        """GET only the response status. 200 and 404 statuses are cached when a ttl is given."""
+        with Tracer.span(urlsplit(url).netloc, 'http', url=url):
+            if ttl is None:
+                async with await cls._send(url, headers) as res:
+                    # Drain the body so the connection can be returned to the pool
+                    Tracer.annotate(bytes=len(await res.read()))
+                    return res.status
+            status, _ = await cls._get_cached(url, headers, ttl, lambda body: None,
+                                              cacheable=(200, 404))
+            return status
+
+    @classmethod
+    async def _send(cls, url: str, headers: Optional[Dict[str, str]]) -> aiohttp.ClientResponse:
+        return await RateLimiter.send(url, lambda: cls.session().get(url, headers=headers))
+
+    @classmethod
+    async def _get_cached(cls, url: str, headers: Optional[Dict[str, str]], ttl: Ttl,
+                          decode: Callable[[bytes], Any],
+                          cacheable: Collection[int]) -> Tuple[int, Any]:
+        cached = ResponseCache.get(url)
+        if cached is not None and cached.is_fresh(time.time()):
+            Tracer.annotate(cache='hit', status=cached.status)
+            return cached.status, decode(cached.body)
+
+        # Stale responses are revalidated, the server only resends the body if it changed
+        request_headers = dict(headers or {})
+        if cached is not None:
+            request_headers.update(cached.validators())
+
+        async with await cls._send(url, request_headers) as res:
+            body = await res.read()
+            Tracer.annotate(bytes=len(body))
+            if res.status == 304 and cached is not None:
+                Tracer.annotate(cache='revalidated')
+                value = decode(cached.body)
+                ResponseCache.revalidated(url, ttl(value) if callable(ttl) else ttl)
+                return cached.status, value
+
+            if res.status not in cacheable:
+                res.raise_for_status()
+                return res.status, None
+
+            Tracer.annotate(cache='miss')
+            value = decode(body)
+            ResponseCache.put(url, res.status, body, res.headers.get('ETag'),
+                              res.headers.get('Last-Modified'), ttl(value) if callable(ttl) else ttl)
+            return res.status, value
+
+    @classmethod
+    async def close(cls) -> None:
+        if cls._session is not None and not cls._session.closed:
+            await cls._session.close()
+        cls._session = None
+        ResponseCache.close()
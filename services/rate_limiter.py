@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import random
+import time
+from typing import Awaitable, Callable, Collection, Dict, Mapping, Optional, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+from asyncprawcore import Requestor
+
+from const import RATE_LIMITS, RATE_LIMIT_DEFAULT, RATE_LIMIT_MAX_SCALE, HTTP_MAX_RETRIES, \
+    HTTP_BACKOFF_BASE_SECONDS, HTTP_BACKOFF_MAX_SECONDS
+from util.tracing import Tracer
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class _Bucket:
+    """Token bucket for one host. Refills at `rate` requests per second up to `burst` tokens."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        # Hosts that don't report their limits are probed upwards until they start throttling
+        self.min_rate = rate / RATE_LIMIT_MAX_SCALE
+        self.max_rate = rate * RATE_LIMIT_MAX_SCALE
+        self.increase = rate / 100
+        self.reports_limits = False
+
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        # Nothing is sent before blocked_until, e.g. while backing off after a 429
+        self.blocked_until = 0.0
+        # Waiters queue on the lock in order so only the head of the queue polls the bucket and
+        # rate changes apply to everyone still waiting
+        self.lock = asyncio.Lock()
+        self.waiters = 0
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for_token(self, now: float) -> float:
+        self.refill(now)
+        return max((1 - self.tokens) / self.rate, self.blocked_until - now, 0.0)
+
+    def queue_wait(self, now: float) -> float:
+        """How long the last request in the queue has left to wait."""
+        if not self.waiters:
+            return 0.0
+        self.refill(now)
+        return max((self.waiters - self.tokens) / self.rate, self.blocked_until - now, 0.0)
+
+    def block(self, now: float, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class RateLimiter:
+    """
+    App wide request pacing with a separate budget per host. Budgets adapt to the
+    X-Ratelimit-Remaining/Reset headers when a host sends them. Otherwise the rate creeps up while
+    requests succeed and halves on every 429.
+    """
+    _buckets: Dict[str, _Bucket] = {}
+
+    @classmethod
+    def _bucket(cls, host: str) -> _Bucket:
+        bucket = cls._buckets.get(host)
+        if bucket is None:
+            bucket = cls._buckets[host] = _Bucket(*RATE_LIMITS.get(host, RATE_LIMIT_DEFAULT))
+        return bucket
+
+    @classmethod
+    async def acquire(cls, host: str) -> None:
+        bucket = cls._bucket(host)
+        bucket.waiters += 1
+        try:
+            async with bucket.lock:
+                while (wait := bucket.wait_for_token(time.monotonic())) > 0:
+                    await asyncio.sleep(wait)
+                bucket.tokens -= 1
+        finally:
+            bucket.waiters -= 1
+
+    @classmethod
+    def update(cls, host: str, status: int, headers: Mapping[str, str]) -> None:
+        bucket = cls._bucket(host)
+        now = time.monotonic()
+        remaining = headers.get('X-Ratelimit-Remaining')
+        reset = headers.get('X-Ratelimit-Reset')
+
+        if status == 429:
+            bucket.rate = max(bucket.min_rate, bucket.rate / 2)
+            bucket.tokens = min(bucket.tokens, 0.0)
+        elif remaining is not None and reset is not None:
+            # Spread what is left of the window evenly over the time until it resets
+            remaining, reset = float(remaining), float(reset)
+            bucket.reports_limits = True
+            if remaining < 1:
+                bucket.block(now, reset)
+            else:
+                bucket.rate = remaining / max(reset, 1.0)
+                bucket.tokens = min(bucket.tokens, remaining)
+        elif status < 400 and not bucket.reports_limits:
+            bucket.rate = min(bucket.max_rate, bucket.rate + bucket.increase)
+
+    @classmethod
+    def backoff(cls, host: str, attempt: int, headers: Mapping[str, str]) -> float:
+        """Jittered exponential delay before retrying a throttled or failed request."""
+        delay = random.uniform(0, min(HTTP_BACKOFF_MAX_SECONDS,
+                                      HTTP_BACKOFF_BASE_SECONDS * 2 ** attempt))
+        try:
+            delay = max(delay, float(headers.get('Retry-After', 0)))
+        except ValueError:
+            # HTTP date form, fall back to the exponential delay
+            pass
+        # Every request to the host waits out the backoff, not only the one being retried
+        cls._bucket(host).block(time.monotonic(), delay)
+        return delay
+
+    @classmethod
+    async def send(cls, url: str, send: Callable[[], Awaitable[aiohttp.ClientResponse]],
+                   retry_statuses: Collection[int] = RETRY_STATUSES) -> aiohttp.ClientResponse:
+        """Send a request within its host's budget, retrying throttled and failed responses."""
+        # Keyed with the port so local stand-ins for different services get their own budgets
+        host = urlsplit(url).netloc
+        attempt = 0
+        # Time spent in the host's queue and backing off, reported on the request's span
+        waited = 0.0
+        while True:
+            start = time.monotonic()
+            await cls.acquire(host)
+            waited += time.monotonic() - start
+            res = await send()
+            cls.update(host, res.status, res.headers)
+            if res.status not in retry_statuses or attempt == HTTP_MAX_RETRIES:
+                Tracer.annotate(status=res.status, retries=attempt,
+                                wait_ms=round(waited * 1000, 1))
+                return res
+            res.release()
+            delay = cls.backoff(host, attempt, res.headers)
+            await asyncio.sleep(delay)
+            waited += delay
+            attempt += 1
+
+    @classmethod
+    def current_wait(cls) -> Tuple[float, Optional[str]]:
+        """The longest time a queued request currently has to wait, and the host it's for."""
+        now = time.monotonic()
+        wait, host = 0.0, None
+        for bucket_host, bucket in cls._buckets.items():
+            bucket_wait = bucket.queue_wait(now)
+            if bucket_wait > wait:
+                wait, host = bucket_wait, bucket_host
+        return wait, host
+
+
+class RateLimitedRequestor(Requestor):
+    """
+    asyncpraw requestor that paces reddit API calls with the shared RateLimiter. asyncprawcore
+    already retries server errors so only 429s are retried here.
+    """
+
+    async def request(self, method: str, url: str, *args, **kwargs) -> aiohttp.ClientResponse:
+        with Tracer.span(urlsplit(url).netloc, 'http', url=url, method=method):
+            res = await RateLimiter.send(
+                url, functools.partial(super().request, method, url, *args, **kwargs),
+                retry_statuses=(429,))
+            # The body is read by asyncprawcore after the span ends, its length is all there is
+            Tracer.annotate(bytes=res.content_length)
+            return res
@@ -0,0 +1,48 @@
+import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+import asyncpraw
+
+from models.user_data import Comment
+
+# Listing pages are read as raw JSON instead of through asyncpraw's objector, which builds a full
+# Comment (and Subreddit) model per item when only four fields are kept
+
+_PAGE_SIZE = 100
+
+
+def parse_comment_listing(listing: dict) -> Tuple[List[Comment], Optional[str]]:
+    """Comments on a raw listing page and the fullname to request the next page after."""
+    data = listing['data']
+    comments = []
+    for child in data['children']:
+        item = child['data']
+        comments.append(Comment(
+            id=item['id'],
+            subreddit=item['subreddit'],
+            created_at=datetime.datetime.fromtimestamp(item['created_utc']).date(),
+            karma=item['score']
+        ))
+    return comments, data.get('after')
+
+
+async def iter_user_comments(reddit: asyncpraw.Reddit, username: str,
+                             limit: int) -> AsyncIterator[Comment]:
+    """
+    A user's comments newest first. Pages are only requested as the iteration reaches them so
+    stopping early saves the remaining requests.
+    """
+    after = None
+    remaining = limit
+    while remaining > 0:
+        params = {'sort': 'new', 'limit': min(_PAGE_SIZE, remaining), 'raw_json': 1}
+        if after is not None:
+            params['after'] = after
+        listing = await reddit.request(method='GET', path=f'user/{username}/comments',
+                                       params=params)
+        comments, after = parse_comment_listing(listing)
+        for comment in comments[:remaining]:
+            yield comment
+        remaining -= len(comments)
+        if after is None or not comments:
+            return
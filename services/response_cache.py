@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import math
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from const import HTTP_CACHE_MAX_BYTES
+
+_DB_PATH = 'data/http_cache.sqlite'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    status INTEGER NOT NULL,
+    body BLOB NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    expires_at REAL,
+    last_used REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+'''
+
+# Time to live for responses that never change, e.g. a repaid loan
+CACHE_FOREVER = math.inf
+
+
+@dataclass
+class CachedResponse:
+    status: int
+    body: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    # None when the response never expires
+    expires_at: Optional[float]
+
+    def is_fresh(self, now: float) -> bool:
+        return self.expires_at is None or now < self.expires_at
+
+    def validators(self) -> Dict[str, str]:
+        """Headers to revalidate the response with a conditional request."""
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    Persistent HTTP response cache used by HttpClient. Each response is stored with the expiry
+    from its caller's TTL and any ETag/Last-Modified validators. Once the store grows past
+    HTTP_CACHE_MAX_BYTES the least recently used responses are evicted.
+    """
+    _connection: Optional[sqlite3.Connection] = None
+    _total_size: int = 0
+
+    @classmethod
+    def _db(cls) -> sqlite3.Connection:
+        if cls._connection is None:
+            os.makedirs(os.path.dirname(_DB_PATH), exist_ok=True)
+            cls._connection = sqlite3.connect(_DB_PATH)
+            cls._connection.execute('PRAGMA journal_mode=WAL')
+            cls._connection.execute('PRAGMA synchronous=NORMAL')
+            with cls._connection:
+                cls._connection.executescript(_SCHEMA)
+            cls._total_size = cls._connection.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        return cls._connection
+
+    @classmethod
+    def get(cls, url: str) -> Optional[CachedResponse]:
+        db = cls._db()
+        row = db.execute('SELECT status, body, etag, last_modified, expires_at FROM responses '
+                         'WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        with db:
+            db.execute('UPDATE responses SET last_used = ? WHERE url = ?', (time.time(), url))
+        return CachedResponse(*row)
+
+    @classmethod
+    def put(cls, url: str, status: int, body: bytes, etag: Optional[str],
+            last_modified: Optional[str], ttl: float) -> None:
+        db = cls._db()
+        now = time.time()
+        previous = db.execute('SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+        with db:
+            db.execute('INSERT OR REPLACE INTO responses '
+                       '(url, status, body, etag, last_modified, expires_at, last_used, size) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       (url, status, body, etag, last_modified, cls._expires_at(now, ttl), now,
+                        len(body)))
+        cls._total_size += len(body) - (previous[0] if previous else 0)
+        if cls._total_size > HTTP_CACHE_MAX_BYTES:
+            cls._evict()
+
+    @classmethod
+    def revalidated(cls, url: str, ttl: float) -> None:
+        """The server confirmed the stored response is still current (304 Not Modified)."""
+        db = cls._db()
+        now = time.time()
+        with db:
+            db.execute('UPDATE responses SET expires_at = ?, last_used = ? WHERE url = ?',
+                       (cls._expires_at(now, ttl), now, url))
+
+    @staticmethod
+    def _expires_at(now: float, ttl: float) -> Optional[float]:
+        return None if ttl == CACHE_FOREVER else now + ttl
+
+    @classmethod
+    def _evict(cls) -> None:
+        # Evict down to 90% of the limit so a full cache isn't trimmed on every put
+        target = HTTP_CACHE_MAX_BYTES * 0.9
+        db = cls._db()
+        evicted = []
+        for url, size in db.execute('SELECT url, size FROM responses ORDER BY last_used'):
+            if cls._total_size <= target:
+                break
+            evicted.append((url,))
+            cls._total_size -= size
+        with db:
+            db.executemany('DELETE FROM responses WHERE url = ?', evicted)
+
+    @classmethod
+    def close(cls) -> None:
+        if cls._connection is not None:
+            cls._connection.close()
+        cls._connection = None
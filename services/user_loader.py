@@ -0,0 +1,504 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import re
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import asyncpraw
+import asyncpraw.models
+from dotenv import load_dotenv
+
+from ai.borrow_request_extractor import extract_borrow_request_async
+from ai.borrow_request_parser import parse_borrow_request, ParserStats
+from ai.extraction_cache import ExtractionCache
+from const import ACTIVITY_DAYS_BACK, COMMENT_LIMIT, LOAN_FETCH_CONCURRENCY, \
+    LOAN_BATCH_WAIT_SECONDS, REDDIT_INFO_BATCH_SIZE, HTTP_CACHE_LOAN_LIST_TTL, \
+    HTTP_CACHE_UNPAID_LOAN_TTL, HTTP_CACHE_USL_TTL, REDDITLOANS_URL, REDDIT_URL, REDDIT_OAUTH_URL, \
+    REDDIT_API_URL
+from models.activity_aggregates import ActivityAggregates
+from models.comment_history import CommentHistory
+from models.save_state import SaveState
+from models.user_data import UserData, UserLoan, LoanRequest, Comment, LoanInstallment
+from services.http_client import HttpClient
+from services.rate_limiter import RateLimitedRequestor
+from services.reddit_listing import iter_user_comments
+from services.response_cache import CACHE_FOREVER
+from util.tracing import Tracer
+
+T = TypeVar('T')
+
+# Called with the new percentage of one or more of the user_info, reddit_activity and
+# loan_history stages, matching ProgressTrackerWidget.update
+ProgressCallback = Callable[..., None]
+ErrorCallback = Callable[[str], None]
+LoanCallback = Callable[[UserLoan], None]
+
+_logger = logging.getLogger(__name__)
+
+
+def _loan_record_ttl(record: dict) -> float:
+    # A repaid loan's record never changes again
+    if record['basic']['repaid_at'] is not None:
+        return CACHE_FOREVER
+    return HTTP_CACHE_UNPAID_LOAN_TTL
+
+
+def create_reddit_client() -> asyncpraw.Reddit:
+    load_dotenv()
+    return asyncpraw.Reddit(
+        client_id=os.getenv('CLIENT_ID'),
+        client_secret=os.getenv('CLIENT_SECRET'),
+        user_agent='cledditor',
+        reddit_url=REDDIT_URL,
+        oauth_url=REDDIT_OAUTH_URL,
+        requestor_class=RateLimitedRequestor
+    )
+
+
+class UserLoader:
+    """
+    Fetches a user's reddit info, USL status, comment history and loan history. Has no UI of its
+    own, progress and errors are reported through the optional callbacks.
+    """
+
+    def __init__(self, username: str, previous_user_data: Optional[UserData] = None,
+                 on_progress: Optional[ProgressCallback] = None,
+                 on_error: Optional[ErrorCallback] = None,
+                 on_loan: Optional[LoanCallback] = None,
+                 log=_logger) -> None:
+        self.username = username
+        # When refreshing a user only data that changed since the previous load is fetched
+        self.previous_user_data = previous_user_data
+        self._on_progress = on_progress or (lambda **_: None)
+        self._on_error = on_error or (lambda _: None)
+        # Called with each loan of the history as soon as it is resolved, in no particular order
+        self._on_loan = on_loan or (lambda _: None)
+        self._log = log
+        self._user_info_stages_done = 0
+        self._failed_stages: List[str] = []
+
+    async def load(self, reddit: Optional[asyncpraw.Reddit] = None) -> UserData:
+        """
+        Load the user. A shared reddit client can be passed in when loading many users, otherwise
+        one is created and closed for this load.
+        """
+        with Tracer.span('load user', 'load', username=self.username,
+                         refresh=self.previous_user_data is not None):
+            return await self._load(reddit)
+
+    async def _load(self, reddit: Optional[asyncpraw.Reddit]) -> UserData:
+        owns_reddit = reddit is None
+        if owns_reddit:
+            reddit = create_reddit_client()
+
+        # Lazy redditor. Only the username is needed to start every stage so nothing is fetched
+        # until the user info stage loads it
+        user: asyncpraw.models.Redditor = await reddit.redditor(self.username, fetch=False)
+
+        # Stages only depend on the username (loan details depend on loan ids and are chained
+        # inside the loan history stage) so they all run concurrently. A failing stage reports
+        # its error and falls back to an empty result rather than aborting the others
+        previous = self.previous_user_data
+        try:
+            user_loaded, user_in_usl, comments, loan_history = await asyncio.gather(
+                self._run_stage('user info', self._fetch_user_info(user), False),
+                # An unchecked user is treated as listed so a failed lookup never clears them
+                self._run_stage('USL status', self._fetch_usl_status(user),
+                                previous.is_in_usl if previous else True),
+                self._run_stage('reddit activity', self._fetch_comments(reddit, user),
+                                previous.comments if previous else CommentHistory()),
+                self._run_stage('loan history', self._fetch_loan_history(reddit, user),
+                                previous.loan_history if previous else []),
+            )
+        finally:
+            if owns_reddit:
+                await reddit.close()
+
+        if user_loaded:
+            created_at = datetime.datetime.fromtimestamp(user.created).date()
+            total_karma, comment_karma = user.total_karma, user.comment_karma
+        elif previous is not None:
+            created_at = previous.created_at
+            total_karma, comment_karma = previous.total_karma, previous.comment_karma
+        else:
+            # Placeholders. The record lists user info as failed so they're never shown as real
+            created_at, total_karma, comment_karma = datetime.date.today(), 0, 0
+
+        return UserData(
+            last_load=datetime.datetime.now(),
+            last_viewed=datetime.datetime.now(),
+            username=user.name,
+            created_at=created_at,
+            total_karma=total_karma,
+            comment_karma=comment_karma,
+            comments=comments,
+            loan_history=loan_history,
+            is_in_usl=user_in_usl,
+            activity=ActivityAggregates.from_comments(comments),
+            failed_stages=self._failed_stages
+        )
+
+    async def _run_stage(self, name: str, stage: Awaitable[T], default: T) -> T:
+        try:
+            with Tracer.span(name, 'stage'):
+                return await stage
+        except Exception as e:
+            self._on_error(f'Failed to load {name}. Check logs for details')
+            self._log.error(f'Stage {name} failed: {e!r}')
+            # The default is the previous load's data when refreshing. Without it the stage's
+            # fields are placeholders and the record is marked as such
+            previous = self.previous_user_data
+            if previous is None or name in previous.failed_stages:
+                self._failed_stages.append(name)
+            return default
+
+    def _update_user_info_progress(self) -> None:
+        # User info and USL status share the user info bar
+        self._user_info_stages_done += 1
+        self._on_progress(user_info=self._user_info_stages_done * 50.0)
+
+    async def _fetch_user_info(self, user: asyncpraw.models.Redditor) -> bool:
+        try:
+            await user.load()
+        finally:
+            self._update_user_info_progress()
+        return True
+
+    async def _fetch_usl_status(self, user: asyncpraw.models.Redditor) -> bool:
+        try:
+            return await self._fetch_in_usl(user.name)
+        finally:
+            self._update_user_info_progress()
+
+    async def _fetch_comments(self, reddit: asyncpraw.Reddit,
+                              user: asyncpraw.models.Redditor) -> CommentHistory:
+        today = datetime.datetime.today().date()
+        date_floor = today - datetime.timedelta(days=ACTIVITY_DAYS_BACK)
+        previous_comments = self.previous_user_data.comments \
+            if self.previous_user_data else CommentHistory()
+        known_ids = previous_comments.id_set()
+
+        comments = CommentHistory()
+        comment: Comment
+        try:
+            async for comment in iter_user_comments(reddit, user.name, COMMENT_LIMIT):
+                # The listing is newest first. Once a comment is already stored or older than the
+                # activity window so is everything after it and no further pages are requested
+                if comment.id in known_ids or comment.created_at < date_floor:
+                    break
+                comments.append(comment)
+                self._on_progress(
+                    reddit_activity=((today - comment.created_at).days / ACTIVITY_DAYS_BACK) * 100)
+        finally:
+            self._on_progress(reddit_activity=100.0)
+        comments.extend(previous_comments)
+        return comments.since(date_floor)[:COMMENT_LIMIT]
+
+    async def _fetch_loan_history(self, reddit: asyncpraw.Reddit,
+                                  user: asyncpraw.models.Redditor) -> List[UserLoan]:
+        try:
+            loan_ids = await self._fetch_loan_ids(user)
+
+            # Loans already resolved for this user or for any other stored user, e.g. the lender
+            # of a loan when vetting its borrower
+            previous_loans = {
+                loan.loan_id: loan for loan in
+                (self.previous_user_data.loan_history if self.previous_user_data else [])
+                if loan.loan_id is not None
+            }
+            known_loans = {}
+            for loan_id in loan_ids:
+                known_loan = previous_loans.get(loan_id) or SaveState.get_loan(loan_id, user.name)
+                if known_loan is not None:
+                    known_loans[loan_id] = known_loan
+
+            # Repaid loans never change. Only new and still unpaid loans are fetched again
+            loan_history = [loan for loan in known_loans.values() if loan.repaid_date is not None]
+            for loan in loan_history:
+                self._on_loan(loan)
+            loan_ids = [loan_id for loan_id in loan_ids
+                        if loan_id not in known_loans or known_loans[loan_id].repaid_date is None]
+
+            # A request post doesn't change either. Unpaid loans whose request was already
+            # extracted only have their record fetched again
+            known_requests = {
+                loan_id: loan.loan_request for loan_id, loan in known_loans.items()
+                if loan.repaid_date is None and loan.loan_request.borrow_amount is not None
+            }
+
+            # Progress covers two steps per loan. Fetching its record and resolving its request
+            steps_done = 0
+
+            def _advance_progress():
+                nonlocal steps_done
+                steps_done += 1
+                self._on_progress(loan_history=(steps_done / (len(loan_ids) * 2)) * 100)
+
+            def _add_loan(loan: UserLoan) -> None:
+                loan_history.append(loan)
+                self._on_loan(loan)
+
+            def _skip_loan(loan_id: int, e: Exception) -> None:
+                # One bad loan doesn't fail the history. A loan from a previous load is kept as it
+                # was, otherwise the loan is left out
+                self._on_error(f'Failed to load loan {loan_id}. Check logs for details')
+                self._log.error(f'Loan {loan_id} failed: {e!r}')
+                if loan_id in known_loans:
+                    _add_loan(known_loans[loan_id])
+
+            # Loans are fetched concurrently but capped so a prolific lender doesn't fire hundreds
+            # of simultaneous requests at redditloans
+            semaphore = asyncio.Semaphore(LOAN_FETCH_CONCURRENCY)
+
+            async def _fetch_record(loan_id: int) -> Optional[Tuple[int, dict, str]]:
+                async with semaphore:
+                    try:
+                        record = await self._fetch_loan_record(loan_id)
+                        return loan_id, record, self._get_request_post_id(record)
+                    except Exception as e:
+                        _skip_loan(loan_id, e)
+                        return None
+
+            async def _resolve_loan(loan_id: int, record: dict,
+                                    post: Optional[asyncpraw.models.Submission]) -> None:
+                try:
+                    _add_loan(await self._fetch_loan_details(user, loan_id, record, post,
+                                                             known_requests.get(loan_id)))
+                except Exception as e:
+                    _skip_loan(loan_id, e)
+                _advance_progress()
+
+            async def _resolve_batch(batch: List[Tuple[int, dict, str]]) -> None:
+                # Request posts are resolved in bulk rather than one submission lookup per loan
+                try:
+                    submissions = await self._fetch_submissions(
+                        reddit, [post_id for loan_id, record, post_id in batch
+                                 if loan_id not in known_requests])
+                except Exception as e:
+                    # The loans are still listed, without the details of their request
+                    self._on_error('Failed to look up loan request posts. Check logs for details')
+                    self._log.error(f'Request post lookup failed: {e!r}')
+                    submissions = {}
+                await asyncio.gather(*[_resolve_loan(loan_id, record, submissions.get(post_id))
+                                       for loan_id, record, post_id in batch])
+
+            # Records are batched as they arrive and each batch is looked up and extracted while
+            # the rest are still being fetched, so the model isn't idle until every record is in.
+            # A batch goes out when it's full or has waited long enough for more records
+            loop = asyncio.get_running_loop()
+            pending = {asyncio.ensure_future(_fetch_record(loan_id)) for loan_id in loan_ids}
+            batch_tasks = []
+            batch: List[Tuple[int, dict, str]] = []
+            batch_deadline = 0.0
+
+            def _send_batch():
+                nonlocal batch
+                if batch:
+                    batch_tasks.append(asyncio.ensure_future(_resolve_batch(batch)))
+                    batch = []
+
+            try:
+                while pending:
+                    timeout = max(0.0, batch_deadline - loop.time()) if batch else None
+                    done, pending = await asyncio.wait(pending, timeout=timeout,
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        _advance_progress()
+                        fetched = task.result()
+                        if fetched is None:
+                            # A skipped loan has no request to resolve
+                            _advance_progress()
+                            continue
+                        if not batch:
+                            batch_deadline = loop.time() + LOAN_BATCH_WAIT_SECONDS
+                        batch.append(fetched)
+                        if len(batch) == REDDIT_INFO_BATCH_SIZE:
+                            _send_batch()
+                    if batch and loop.time() >= batch_deadline:
+                        _send_batch()
+                _send_batch()
+                await asyncio.gather(*batch_tasks)
+            finally:
+                # Failed loans are skipped, only a cancelled load gets here with tasks still
+                # running. Nothing is left behind
+                for task in [*pending, *batch_tasks]:
+                    task.cancel()
+            loan_history.sort(key=lambda r: r.borrow_date)
+            self._log.info(f'Title parser hit rate: {ParserStats.hit_rate():.0%} '
+                           f'({ParserStats.hits} hits, {ParserStats.misses} misses)')
+        finally:
+            self._on_progress(loan_history=100.0)
+        return loan_history
+
+    async def _fetch_loan_ids(self, user: asyncpraw.models.Redditor):
+        lend_history = f"{REDDITLOANS_URL}/api/loans?lender_name={user.name}"
+        lend_ids = await HttpClient.get_json(lend_history, ttl=HTTP_CACHE_LOAN_LIST_TTL)
+
+        borrow_history = f"{REDDITLOANS_URL}/api/loans?borrower_name={user.name}"
+        borrow_ids = await HttpClient.get_json(borrow_history, ttl=HTTP_CACHE_LOAN_LIST_TTL)
+
+        return lend_ids + borrow_ids
+
+    async def _fetch_loan_record(self, loan_id: int) -> dict:
+        # Fetch loan details from loans API
+        loan_url = f"{REDDITLOANS_URL}/api/loans/{loan_id}/detailed"
+        return await HttpClient.get_json(loan_url, ttl=_loan_record_ttl)
+
+    @staticmethod
+    def _get_request_permalink(record: dict) -> str:
+        creation_event = None
+        for event in record['events']:
+            if event['event_type'] == 'creation':
+                creation_event = event
+                break
+        assert (creation_event is not None)
+
+        return creation_event['creation_permalink']
+
+    @classmethod
+    def _get_request_post_id(cls, record: dict) -> str:
+        res = re.match('https://www.reddit.com/comments/([^/]+)',
+                       cls._get_request_permalink(record))
+        return res.group(1)
+
+    async def _fetch_submissions(self, reddit: asyncpraw.Reddit, post_ids: List[str]) \
+            -> Dict[str, asyncpraw.models.Submission]:
+        # The info endpoint accepts up to 100 fullnames per request. asyncpraw splits larger id
+        # lists into chunks of 100 so a 300 loan user costs 3 requests instead of 300
+        submissions = {}
+        if not post_ids:
+            return submissions
+
+        submission: asyncpraw.models.Submission
+        with Tracer.span('request posts', 'step', posts=len(post_ids)):
+            async for submission in reddit.info(
+                    fullnames=[f't3_{post_id}' for post_id in dict.fromkeys(post_ids)]):
+                submissions[submission.id] = submission
+        return submissions
+
+    async def _fetch_loan_details(self, user: asyncpraw.models.Redditor, loan_id: int,
+                                  record: dict, post: Optional[asyncpraw.models.Submission],
+                                  loan_request: Optional[LoanRequest] = None) -> UserLoan:
+        basic = record['basic']
+
+        currency_exponent = basic['currency_exponent']
+        currency_divisor = 10 ** currency_exponent
+
+        lender = basic['lender']
+        borrower = basic['borrower']
+        currency_code = basic['currency_code']
+        borrow_amount = basic['principal_minor'] / currency_divisor
+        repaid_amount = basic['principal_repayment_minor'] / currency_divisor
+        borrow_date = datetime.datetime.fromtimestamp(basic['created_at']).date()
+        repaid_date = datetime.datetime.fromtimestamp(basic['repaid_at']).date() \
+            if basic['repaid_at'] is not None else None
+        is_borrower = user.name.lower() == borrower.lower()
+
+        if loan_request is None:
+            loan_request = await self._resolve_loan_request(record, post, borrow_date)
+
+        return UserLoan(
+            lender=lender,
+            borrower=borrower,
+            currency_code=currency_code,
+            borrow_amount=borrow_amount,
+            repaid_amount=repaid_amount,
+            borrow_date=borrow_date,
+            repaid_date=repaid_date,
+            is_borrower=is_borrower,
+            loan_request=loan_request,
+            loan_id=loan_id
+        )
+
+    async def _resolve_loan_request(self, record: dict,
+                                    post: Optional[asyncpraw.models.Submission],
+                                    borrow_date: datetime.date) -> LoanRequest:
+        # Fetch loan request details
+        loan_request_borrow_amount = None
+        loan_request_repay_amount = None
+        loan_request_repay_date = None
+        loan_request_repay_installments = []
+        loan_request_payment_types = []
+
+        loan_request_permalink = self._get_request_permalink(record)
+        post_id = self._get_request_post_id(record)
+
+        # Deleted posts aren't returned by reddit. Fall back to the borrow date so the loan is still
+        # listed without request details
+        post_title = post.title if post is not None else None
+        loan_request_created_at = datetime.datetime.fromtimestamp(post.created_utc).date() \
+            if post is not None else borrow_date
+
+        ai_out = None
+        try:
+            if post_title is None:
+                raise LookupError(f'Request post {post_id} not found')
+
+            # Standard titles are parsed by rules, only the rest go to the cache or the model
+            ai_json = parse_borrow_request(loan_request_created_at, post_title)
+            ParserStats.record(hit=ai_json is not None)
+            from_model = False
+            if ai_json is None:
+                ai_out = ExtractionCache.get(post_id, post_title)
+                if ai_out is None:
+                    ai_out = await extract_borrow_request_async(loan_request_created_at,
+                                                                post_title)
+                    from_model = True
+                ai_json = json.loads(ai_out)
+
+                self._log.info(ai_out)
+
+            loan_request_borrow_amount = ai_json['borrow_amount']
+            loan_request_payment_types = ai_json.get('payment_types') or []
+
+            def _try_parse_date(dt: Optional[str]):
+                if dt is None:
+                    return None
+                return datetime.datetime.strptime(dt, '%Y-%m-%d').date()
+
+            loan_request_repay_installments = [
+                LoanInstallment(
+                    repay_amount=repay_installment.get('repay_amount'),
+                    repay_date=_try_parse_date(repay_installment.get('repay_date'))
+                )
+                for repay_installment in ai_json.get('repay_installments') or []
+            ]
+
+            repay_amounts = [inst.repay_amount for inst in loan_request_repay_installments if
+                             inst.repay_amount is not None]
+            repay_dates = [inst.repay_date for inst in loan_request_repay_installments if
+                           inst.repay_date is not None]
+
+            loan_request_repay_amount = sum(repay_amounts) if repay_amounts else 0
+            loan_request_repay_date = max(repay_dates) if repay_dates else None
+
+            # Only outputs that parsed cleanly are cached, failures get another attempt next load
+            if from_model:
+                ExtractionCache.put(post_id, post_title, ai_out)
+        except Exception as e:
+            self._on_error('Exception occurred parsing loan request post. Check logs for details')
+            self._log.error(f'Failed to parse: {post_title}')
+            self._log.error(f'Error: {e}')
+            self._log.error(f'AI Output: {ai_out}')
+
+        return LoanRequest(
+            created_at=loan_request_created_at,
+            permalink=loan_request_permalink,
+            post_id=post_id,
+            borrow_amount=loan_request_borrow_amount,
+            repay_installments=loan_request_repay_installments,
+            payment_types=loan_request_payment_types,
+            repay_amount=loan_request_repay_amount,
+            repay_date=loan_request_repay_date
+        )
+
+    async def _fetch_in_usl(self, username: str):
+        status = await HttpClient.get_status(
+            f'{REDDIT_API_URL}/r/RegExrSwapBot/wiki/confirmations/{username.lower()}.json',
+            headers={
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:133.0) Gecko/20100101 Firefox/133.0'
+            },
+            ttl=HTTP_CACHE_USL_TTL)
+        return status != 404
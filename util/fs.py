@@ -0,0 +1,23 @@
+import os
+import tempfile
+
+
+def atomic_write(path: str, content: str) -> None:
+    """
+    Write a file so readers only ever see the old or the new content. The content is written to a
+    temp file in the same directory and renamed over the target, a crash mid write leaves the
+    original file untouched.
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
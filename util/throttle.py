@@ -0,0 +1,32 @@
+import asyncio
+import time
+from typing import Callable, Optional
+
+
+class Throttle:
+    """
+    Runs a flush callback at most once per interval. Callers mark that there is something to flush
+    and any further marks before the flush runs are folded into it.
+    """
+
+    def __init__(self, interval: float, flush: Callable[[], None]) -> None:
+        self.interval = interval
+        self._flush = flush
+        self._last_flush = 0.0
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+    def schedule(self) -> None:
+        if self._handle is not None:
+            return
+        delay = max(0.0, self._last_flush + self.interval - time.monotonic())
+        self._handle = asyncio.get_running_loop().call_later(delay, self._run)
+
+    def flush_now(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._run()
+
+    def _run(self) -> None:
+        self._handle = None
+        self._last_flush = time.monotonic()
+        self._flush()
@@ -0,0 +1,245 @@
+import asyncio
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from const import TRACE_MAX_SPANS
+from util.fs import atomic_write
+
+TRACE_FORMATS = ['chrome', 'json']
+
+_current: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('span', default=None)
+_ids = itertools.count(1)
+
+
+class Span:
+    """
+    One timed operation. Nested spans are linked to the span that was current when they started,
+    which follows the call into tasks started under it.
+    """
+    __slots__ = ('id', 'name', 'category', 'args', 'parent_id', 'root_id', 'lane', 'lane_name',
+                 'start_ns', 'end_ns', '_token')
+
+    def __init__(self, name: str, category: str, args: Dict[str, Any]) -> None:
+        self.id = next(_ids)
+        self.name = name
+        self.category = category
+        self.args = args
+        self.parent_id: Optional[int] = None
+        self.root_id = self.id
+        self.lane = 0
+        self.lane_name = ''
+        self.start_ns = 0
+        self.end_ns = 0
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def elapsed_ms(self) -> float:
+        """Time since the span started, for marking points within it."""
+        return round((time.perf_counter_ns() - self.start_ns) / 1e6, 1)
+
+    def set(self, **args) -> None:
+        self.args.update(args)
+
+    def __enter__(self) -> 'Span':
+        parent = _current.get()
+        if parent is not None:
+            self.parent_id = parent.id
+            self.root_id = parent.root_id
+        self.lane, self.lane_name = Tracer.lane()
+        self._token = _current.set(self)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.end_ns = time.perf_counter_ns()
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        Tracer.record(self)
+
+
+class _NullSpan:
+    """Stands in for every span while tracing is off."""
+
+    def elapsed_ms(self) -> float:
+        return 0.0
+
+    def set(self, **args) -> None:
+        pass
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+@dataclass
+class SpanStats:
+    category: str
+    name: str
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    bytes: int = 0
+    retries: int = 0
+    cache_hits: int = 0
+    errors: int = 0
+
+    def add(self, span: Span) -> None:
+        duration = span.duration_ms
+        self.count += 1
+        self.total_ms += duration
+        self.max_ms = max(self.max_ms, duration)
+        self.bytes += span.args.get('bytes') or 0
+        self.retries += span.args.get('retries') or 0
+        self.cache_hits += span.args.get('cache') in ('hit', 'revalidated')
+        self.errors += 'error' in span.args
+
+
+class Tracer:
+    """
+    App wide span recorder for load stages, HTTP and model calls. Off by default, while off
+    `span` hands back a shared no-op span and `annotate` returns straight away so the hooks can
+    stay in the hot paths.
+    """
+    enabled = False
+    _spans: Deque[Span] = deque(maxlen=TRACE_MAX_SPANS)
+    _origin_ns = 0
+    _origin_time = 0.0
+    # Chrome traces draw each lane as a thread. Every task gets its own lane so concurrent spans
+    # don't overlap on one row. Held weakly so finished tasks drop out, their spans keep the lane
+    _lanes: 'weakref.WeakKeyDictionary[Any, Tuple[int, str]]' = weakref.WeakKeyDictionary()
+    _lane_ids = itertools.count(1)
+
+    @classmethod
+    def enable(cls) -> None:
+        if not cls.enabled:
+            cls.enabled = True
+            cls.clear()
+
+    @classmethod
+    def clear(cls) -> None:
+        cls._spans.clear()
+        cls._lanes.clear()
+        cls._lane_ids = itertools.count(1)
+        cls._origin_ns = time.perf_counter_ns()
+        cls._origin_time = time.time()
+
+    @classmethod
+    def span(cls, name: str, category: str, **args):
+        if not cls.enabled:
+            return _NULL_SPAN
+        return Span(name, category, args)
+
+    @classmethod
+    def annotate(cls, **args) -> None:
+        """Add details to the current span, e.g. the retries of the request it wraps."""
+        if not cls.enabled:
+            return
+        span = _current.get()
+        if span is not None:
+            span.args.update(args)
+
+    @classmethod
+    def record(cls, span: Span) -> None:
+        cls._spans.append(span)
+
+    @classmethod
+    def lane(cls) -> Tuple[int, str]:
+        """Lane number and name of the current task, or thread outside of one."""
+        try:
+            owner = asyncio.current_task()
+        except RuntimeError:
+            owner = None
+        if owner is None:
+            owner = threading.current_thread()
+        lane = cls._lanes.get(owner)
+        if lane is None:
+            name = owner.get_name() if isinstance(owner, asyncio.Task) else owner.name
+            lane = cls._lanes[owner] = (next(cls._lane_ids), name)
+        return lane
+
+    @classmethod
+    def spans(cls, root: Optional[Span] = None) -> List[Span]:
+        """Finished spans in the order they ended, only those under root when given."""
+        if root is None:
+            return list(cls._spans)
+        return [span for span in cls._spans if span.root_id == root.root_id]
+
+    @classmethod
+    def find_last(cls, name: str, **args) -> Optional[Span]:
+        """The most recently finished span with this name and args."""
+        for span in reversed(cls._spans):
+            if span.name == name and all(span.args.get(key) == value
+                                         for key, value in args.items()):
+                return span
+        return None
+
+    @classmethod
+    def summary(cls, root: Optional[Span] = None) -> List[SpanStats]:
+        """Spans totalled by category and name, slowest total first."""
+        stats: Dict[tuple, SpanStats] = {}
+        for span in cls.spans(root):
+            key = (span.category, span.name)
+            if key not in stats:
+                stats[key] = SpanStats(span.category, span.name)
+            stats[key].add(span)
+        return sorted(stats.values(), key=lambda s: s.total_ms, reverse=True)
+
+    @classmethod
+    def _start_ms(cls, span: Span) -> float:
+        return (span.start_ns - cls._origin_ns) / 1e6
+
+    @classmethod
+    def to_json(cls) -> dict:
+        return {
+            'started_at': cls._origin_time,
+            'spans': [{
+                'id': span.id,
+                'parent': span.parent_id,
+                'name': span.name,
+                'category': span.category,
+                'start_ms': round(cls._start_ms(span), 3),
+                'duration_ms': round(span.duration_ms, 3),
+                'args': span.args,
+            } for span in cls._spans],
+            'summary': [vars(stats) for stats in cls.summary()],
+        }
+
+    @classmethod
+    def to_chrome_trace(cls) -> dict:
+        """Trace Event Format, opens in chrome://tracing and ui.perfetto.dev."""
+        pid = os.getpid()
+        lane_names = {span.lane: span.lane_name for span in cls._spans}
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': lane,
+                   'args': {'name': name}} for lane, name in lane_names.items()]
+        events.extend({
+            'name': span.name,
+            'cat': span.category,
+            'ph': 'X',
+            'ts': round(cls._start_ms(span) * 1000, 1),
+            'dur': round(span.duration_ms * 1000, 1),
+            'pid': pid,
+            'tid': span.lane,
+            'args': span.args,
+        } for span in cls._spans)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    @classmethod
+    def export(cls, path: str, fmt: str = 'chrome') -> None:
+        trace = cls.to_chrome_trace() if fmt == 'chrome' else cls.to_json()
+        atomic_write(path, json.dumps(trace, default=str))
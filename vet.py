@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import sys
+from typing import Iterable, List, TextIO
+
+from dotenv import load_dotenv
+
+from ai.extraction_cache import ExtractionCache
+from const import VET_CONCURRENCY
+from models.save_state import SaveState
+from models.user_data import UserData
+from models.vetting import RedFlags, account_age_days
+from services.http_client import HttpClient
+from services.user_loader import UserLoader, create_reddit_client
+from util.tracing import Tracer, TRACE_FORMATS
+
+# Headless vetting. Loads every username from a file (or stdin) without the UI, saves the results
+# into the same cache the app uses and streams one result row per user as each one finishes.
+#
+# `python vet.py usernames.txt --format csv > results.csv`
+
+_FIELDS = ['username', 'account_age_days', 'total_karma', 'comment_karma', 'in_usl',
+           'loans_borrowed', 'loans_lent', 'unpaid_borrowed', 'red_flags', 'failed_stages',
+           'errors']
+
+
+def _result_row(user_data: UserData, errors: List[str]) -> dict:
+    borrowed = [loan for loan in user_data.loan_history if loan.is_borrower]
+    # Fields of failed stages are left empty rather than reported as zeros
+    info_loaded = 'user info' not in user_data.failed_stages
+    loans_loaded = 'loan history' not in user_data.failed_stages
+    return {
+        'username': user_data.username,
+        'account_age_days': account_age_days(user_data) if info_loaded else None,
+        'total_karma': user_data.total_karma if info_loaded else None,
+        'comment_karma': user_data.comment_karma if info_loaded else None,
+        'in_usl': user_data.is_in_usl if 'USL status' not in user_data.failed_stages else None,
+        'loans_borrowed': len(borrowed) if loans_loaded else None,
+        'loans_lent': len(user_data.loan_history) - len(borrowed) if loans_loaded else None,
+        'unpaid_borrowed': sum(1 for loan in borrowed if loan.repaid_date is None)
+        if loans_loaded else None,
+        'red_flags': RedFlags.check(user_data).names(),
+        'failed_stages': user_data.failed_stages,
+        'errors': errors,
+    }
+
+
+class _ResultWriter:
+    def __init__(self, out: TextIO, fmt: str) -> None:
+        self._out = out
+        self._csv = None
+        if fmt == 'csv':
+            self._csv = csv.DictWriter(out, fieldnames=_FIELDS)
+            self._csv.writeheader()
+
+    def write(self, row: dict) -> None:
+        if self._csv is not None:
+            self._csv.writerow({**row, 'red_flags': ';'.join(row['red_flags']),
+                                'failed_stages': ';'.join(row['failed_stages']),
+                                'errors': ';'.join(row['errors'])})
+        else:
+            self._out.write(json.dumps(row) + '\n')
+        # Flushed per row so results can be consumed while the batch is still running
+        self._out.flush()
+
+
+async def _vet_user(username: str, reddit, semaphore: asyncio.Semaphore) -> dict:
+    async with semaphore:
+        errors = []
+        # A cached user is refreshed incrementally, the same as the refresh button
+        loader = UserLoader(username, previous_user_data=SaveState.get_user(username),
+                            on_error=errors.append)
+        user_data = await loader.load(reddit)
+        SaveState.save_user(user_data)
+        return _result_row(user_data, errors)
+
+
+async def vet(usernames: Iterable[str], out: TextIO, fmt: str = 'jsonl',
+              concurrency: int = VET_CONCURRENCY) -> None:
+    """Vet every user, writing a row for each as it finishes."""
+    writer = _ResultWriter(out, fmt)
+    # One reddit client is shared by every load so asyncpraw rate limits the whole batch against
+    # the API's limits. Outbound HTTP is already pooled and capped per host by HttpClient
+    reddit = create_reddit_client()
+    semaphore = asyncio.Semaphore(concurrency)
+    try:
+        for next_row in asyncio.as_completed(
+                [_vet_user(username, reddit, semaphore) for username in dict.fromkeys(usernames)]):
+            writer.write(await next_row)
+    finally:
+        await reddit.close()
+        await HttpClient.close()
+        ExtractionCache.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Vet reddit users without the UI')
+    parser.add_argument('file', nargs='?', type=argparse.FileType('r'), default=sys.stdin,
+                        help='usernames, one per line. Reads stdin when omitted')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl')
+    parser.add_argument('--concurrency', type=int, default=VET_CONCURRENCY,
+                        help='users loaded at once')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log progress to stderr')
+    parser.add_argument('--trace', metavar='PATH',
+                        help='time every stage, request and model call and save them to PATH')
+    parser.add_argument('--trace-format', choices=TRACE_FORMATS, default='chrome')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    usernames = [line.strip().removeprefix('u/') for line in args.file if line.strip()]
+
+    load_dotenv()
+    SaveState.__cls_init__()
+    ExtractionCache.__cls_init__()
+    if args.trace:
+        Tracer.enable()
+    try:
+        asyncio.run(vet(usernames, sys.stdout, args.format, args.concurrency))
+    finally:
+        if args.trace:
+            Tracer.export(args.trace, args.trace_format)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,185 @@
-from rich.table import Table
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Tuple
+
+from rich.segment import Segment
+from rich.style import Style
+from rich.text import Text
+from textual import events
 from textual.app import ComposeResult
-from textual.containers import Vertical
-from textual.widgets import Static, Label
+from textual.containers import Horizontal, Vertical
+from textual.geometry import Size
+from textual.message import Message
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+from textual.widgets import Static, Label, Checkbox, Input
+
+from models.user_data import UserData, UserLoan
+
+# (label, justify, sort key)
+_COLUMNS: List[Tuple[str, str, Callable[[UserLoan], Any]]] = [
+    ('status', 'left', lambda loan: loan.repaid_date is not None),
+    ('lender', 'left', lambda loan: loan.lender.lower()),
+    ('borrower', 'left', lambda loan: loan.borrower.lower()),
+    ('cur', 'left', lambda loan: loan.currency_code),
+    ('amt', 'right', lambda loan: loan.borrow_amount),
+    ('repaid', 'right', lambda loan: loan.repaid_amount),
+    ('borrow dt', 'right', lambda loan: loan.borrow_date),
+    ('repay dt', 'right', lambda loan: loan.repaid_date),
+    ('req dt', 'right', lambda loan: loan.loan_request.created_at),
+    ('req amt', 'right', lambda loan: loan.loan_request.borrow_amount),
+    ('rq repay amt', 'right', lambda loan: loan.loan_request.repay_amount),
+    ('rq repay dt', 'right', lambda loan: loan.loan_request.repay_date),
+    ('installments', 'right', lambda loan: len(loan.loan_request.repay_installments or ()) or None),
+    ('link', 'left', lambda loan: loan.loan_request.permalink),
+]
+
+_BORROW_DATE_COLUMN = 6
+
+
+@dataclass
+class LoanRow:
+    """A loan's cells and filter fields, computed once when the loan is added to the table."""
+    loan: UserLoan
+    cells: Tuple[Text, ...]
+    sort_keys: Tuple[Any, ...]
+    is_unpaid: bool
+    is_flagged: bool
+    # The other party of the loan, lowercased for filtering
+    counterparty: str
+
+    @classmethod
+    def from_loan(cls, loan: UserLoan, username: str) -> 'LoanRow':
+        # User did not get the loan on the same day of request
+        flag_borrow_date = loan.loan_request.created_at != loan.borrow_date
+        # The borrow amount change from the request
+        flag_borrow_amount = loan.loan_request.borrow_amount != loan.borrow_amount
+        # The actual repay date is past the proposed repay date. Repayment may have been late
+        flag_repay_date = loan.loan_request.repay_date is not None and loan.repaid_date is not None and loan.loan_request.repay_date < loan.repaid_date
+
+        def _highlight_inspected_user(name: str) -> Text:
+            return Text(name, style='bold blue') if name.lower() == username.lower() else Text(name)
+
+        def _warn_if(value, flag: bool, match: int) -> Text:
+            return Text(f'{value}|{match}', style='yellow') if flag else Text(str(value))
+
+        cells = (
+            Text('Unpaid', style='red bold') if loan.repaid_date is None else Text('Paid', style='green bold'),
+            _highlight_inspected_user(loan.lender),
+            _highlight_inspected_user(loan.borrower),
+            Text(loan.currency_code),
+            _warn_if(loan.borrow_amount, flag_borrow_amount, 1),
+            Text(str(loan.repaid_amount)),
+            _warn_if(loan.borrow_date, flag_borrow_date, 2),
+            _warn_if(loan.repaid_date, flag_repay_date, 3),
+            _warn_if(loan.loan_request.created_at, flag_borrow_date, 2),
+            _warn_if(loan.loan_request.borrow_amount, flag_borrow_amount, 1),
+            Text(str(loan.loan_request.repay_amount)),
+            _warn_if(loan.loan_request.repay_date, flag_repay_date, 3),
+            Text(str(len(loan.loan_request.repay_installments))
+                 if loan.loan_request.repay_installments else '?'),
+            Text('post', style=Style(link=loan.loan_request.permalink)),
+        )
+        for cell, (_, justify, _) in zip(cells, _COLUMNS):
+            cell.justify = justify
+
+        return cls(
+            loan=loan,
+            cells=cells,
+            sort_keys=tuple(key(loan) for _, _, key in _COLUMNS),
+            is_unpaid=loan.repaid_date is None,
+            is_flagged=flag_borrow_date or flag_borrow_amount or flag_repay_date,
+            counterparty=(loan.lender if loan.is_borrower else loan.borrower).lower()
+        )
+
+
+class LoanTable(ScrollView, can_focus=True):
+    """
+    Table over a list of LoanRows that only renders the lines in view, so drawing it costs the
+    same for ten loans or ten thousand. The header stays put while the rows scroll under it.
+    """
+    COMPONENT_CLASSES = {'loan-table--header', 'loan-table--odd-row'}
+
+    class HeaderSelected(Message):
+        def __init__(self, column_index: int) -> None:
+            self.column_index = column_index
+            super().__init__()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.rows: List[LoanRow] = []
+        self.widths: List[int] = []
+        self.header: List[Text] = []
+        self._strips: Dict[int, Strip] = {}
 
-from models.user_data import UserData
+    def show(self, rows: List[LoanRow], widths: List[int], header: List[Text]) -> None:
+        self.rows = rows
+        self.widths = widths
+        self.header = header
+        self._strips.clear()
+        self.virtual_size = Size(sum(width + 2 for width in widths), len(rows) + 1)
+        self.refresh()
+
+    def on_resize(self) -> None:
+        self._strips.clear()
+
+    def render_line(self, y: int) -> Strip:
+        scroll_x, scroll_y = self.scroll_offset
+        if y == 0:
+            strip = self._render_cells(self.header, self.get_component_rich_style('loan-table--header'))
+        else:
+            index = scroll_y + y - 1
+            if index >= len(self.rows):
+                return Strip.blank(self.size.width, self.rich_style)
+            strip = self._strips.get(index)
+            if strip is None:
+                style = self.get_component_rich_style('loan-table--odd-row') if index % 2 else self.rich_style
+                strip = self._render_cells(self.rows[index].cells, style)
+                # Rows scrolled past stay cached, bounded so a long scroll doesn't keep them all
+                if len(self._strips) > 1000:
+                    self._strips.clear()
+                self._strips[index] = strip
+        return strip.crop_extend(scroll_x, scroll_x + self.size.width, self.rich_style)
+
+    def _render_cells(self, cells, style: Style) -> Strip:
+        console = self.app.console
+        segments = []
+        for cell, width in zip(cells, self.widths):
+            text = cell.copy()
+            text.align(cell.justify or 'left', width)
+            segments.append(Segment(' '))
+            segments.extend(text.render(console))
+            segments.append(Segment(' '))
+        return Strip(segments).apply_style(style)
+
+    def on_click(self, event: events.Click) -> None:
+        if event.y != 0:
+            return
+        x = event.x + self.scroll_offset.x
+        for index, width in enumerate(self.widths):
+            x -= width + 2
+            if x < 0:
+                self.post_message(self.HeaderSelected(index))
+                return
 
 
 class LoanHistoryWidget(Static):
+    """
+    Loan history table with sorting and filters. Cells are built once per loan, sorting and
+    filtering only reorder the rows handed to the LoanTable.
+    """
 
     def __init__(self, user_data: UserData, **kwargs):
         self.user_data = user_data
+        self.rows: List[LoanRow] = []
+        # Widths fit every loan so columns don't jump as filters change. Headers keep room for the
+        # sort arrow
+        self.column_widths = [len(label) + 2 for label, _, _ in _COLUMNS]
+        self._add_rows(user_data.loan_history)
+        self.sort_column = _BORROW_DATE_COLUMN
+        self.sort_reverse = False
         super().__init__(**kwargs)
 
     def compose(self) -> ComposeResult:
-        loan_history_table = self.get_loan_history_table()
         with Vertical():
             yield Label(
                 'Field marked in orange are [yellow]warnings[/]. The number after the | marks the corresponding field.')
@@ -25,59 +191,74 @@ class LoanHistoryWidget(Static):
             yield Label(
                 '[u]Repay Date [3][/]: Loan was repaid after the rq repay date. Possible late payment')
             yield Label('')
-            loan_history_container = Static()
-            loan_history_container.update(loan_history_table)
-            yield loan_history_container
-
-    def get_loan_history_table(self) -> Table:
-        loan_history = self.user_data.loan_history
-
-        def _highlight_inspected_user(username: str) -> str:
-            return f'[bold blue]{username}[/]' if username.lower() == self.user_data.username.lower() else username
-
-        def _warn_if(value, flag: bool, match: int):
-            return f'[yellow]{value}|{match}[/]' if flag else str(value)
-
-        table = Table()
-        table.add_column('status')
-        table.add_column('lender')
-        table.add_column('borrower')
-        table.add_column('cur')
-        table.add_column('amt', justify='right')
-        table.add_column('repaid', justify='right')
-        table.add_column('borrow dt', justify='right')
-        table.add_column('repay dt', justify='right')
-        table.add_column('req dt', justify='right')
-        table.add_column('req amt', justify='right')
-        table.add_column('rq repay amt', justify='right')
-        table.add_column('rq repay dt', justify='right')
-        table.add_column('installments', justify='right')
-        table.add_column('link')
-
-        for row in loan_history:
-            # User did not get the loan on the same day of request
-            flag_borrow_date = row.loan_request.created_at != row.borrow_date
-            # The borrow amount change from the request
-            flag_borrow_amount = row.loan_request.borrow_amount != row.borrow_amount
-            # The actual repay date is past the proposed repay date. Repayment may have been late
-            flag_repay_date = row.loan_request.repay_date is not None and row.repaid_date is not None and row.loan_request.repay_date < row.repaid_date
-
-            table.add_row(
-                '[red bold]Unpaid[/]' if row.repaid_date is None else '[green bold]Paid[/]',
-                _highlight_inspected_user(row.lender),
-                _highlight_inspected_user(row.borrower),
-                row.currency_code,
-                _warn_if(row.borrow_amount, flag_borrow_amount, 1),
-                str(row.repaid_amount),
-                _warn_if(row.borrow_date, flag_borrow_date, 2),
-                _warn_if(row.repaid_date, flag_repay_date, 3),
-                _warn_if(row.loan_request.created_at, flag_borrow_date, 2),
-                _warn_if(row.loan_request.borrow_amount, flag_borrow_amount, 1),
-                str(row.loan_request.repay_amount),
-                _warn_if(row.loan_request.repay_date, flag_repay_date, 3),
-                str(len(
-                    row.loan_request.repay_installments)) if row.loan_request.repay_installments else '?',
-                f'[link={row.loan_request.permalink}]post[/]',
-            )
-
-        return table
+            with Horizontal(id='loan_history_filters'):
+                yield Checkbox('Unpaid only', id='unpaid_only')
+                yield Checkbox('Flagged only', id='flagged_only')
+                yield Input(placeholder='Counterparty', id='counterparty_filter')
+                yield Label('', id='loan_history_count')
+            yield LoanTable(id='loan_history_table')
+
+    def on_mount(self) -> None:
+        self._show_rows()
+
+    def add_loans(self, loans: List[UserLoan]) -> None:
+        """Add loans to the table while the history is still being loaded."""
+        self.user_data.loan_history.extend(loans)
+        self.user_data.loan_history.sort(key=lambda r: r.borrow_date)
+        self._add_rows(loans)
+        self._show_rows()
+
+    def _add_rows(self, loans: List[UserLoan]) -> None:
+        widths = self.column_widths
+        for loan in loans:
+            row = LoanRow.from_loan(loan, self.user_data.username)
+            for index, cell in enumerate(row.cells):
+                widths[index] = max(widths[index], cell.cell_len)
+            self.rows.append(row)
+
+    def on_checkbox_changed(self, event: Checkbox.Changed) -> None:
+        event.stop()
+        self._show_rows()
+
+    def on_input_changed(self, event: Input.Changed) -> None:
+        event.stop()
+        self._show_rows()
+
+    def on_loan_table_header_selected(self, message: LoanTable.HeaderSelected) -> None:
+        if message.column_index == self.sort_column:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_column = message.column_index
+            self.sort_reverse = False
+        self._show_rows()
+
+    def _visible_rows(self) -> List[LoanRow]:
+        unpaid_only = self.query_one('#unpaid_only', Checkbox).value
+        flagged_only = self.query_one('#flagged_only', Checkbox).value
+        counterparty = self.query_one('#counterparty_filter', Input).value.strip().lower()
+
+        rows = [
+            row for row in self.rows
+            if (not unpaid_only or row.is_unpaid)
+            and (not flagged_only or row.is_flagged)
+            and counterparty in row.counterparty
+        ]
+
+        # Rows missing the sort value go last in either direction
+        column = self.sort_column
+        present = [row for row in rows if row.sort_keys[column] is not None]
+        missing = [row for row in rows if row.sort_keys[column] is None]
+        present.sort(key=lambda row: row.sort_keys[column], reverse=self.sort_reverse)
+        return present + missing
+
+    def _show_rows(self) -> None:
+        rows = self._visible_rows()
+        header = []
+        for index, (label, justify, _) in enumerate(_COLUMNS):
+            arrow = (' ▼' if self.sort_reverse else ' ▲') if index == self.sort_column else ''
+            header.append(Text(label + arrow, justify=justify))
+
+        self.query_one(LoanTable).show(rows, list(self.column_widths), header)
+        self.query_one('#loan_history_count', Label).update(
+            'Loan history failed to load' if 'loan history' in self.user_data.failed_stages
+            else f'{len(rows)} of {len(self.rows)} loans')
@@ -4,6 +4,8 @@ from textual.app import ComposeResult
 from textual.containers import Vertical
 from textual.widgets import Static, ProgressBar, Label
 
+from services.rate_limiter import RateLimiter
+
 
 class ProgressTrackerWidget(Static):
     def compose(self) -> ComposeResult:
@@ -23,6 +25,15 @@ class ProgressTrackerWidget(Static):
                 yield Label('Loan History')
                 yield ProgressBar(id='loan_history', total=100)
                 yield Static(classes="gutter")
+            yield Label(id='rate_limit_wait')
+
+    def on_mount(self) -> None:
+        self.set_interval(0.25, self._update_rate_limit_wait)
+
+    def _update_rate_limit_wait(self) -> None:
+        wait, host = RateLimiter.current_wait()
+        self.query_one('#rate_limit_wait', Label).update(
+            f'Rate limited by {host}, waiting {wait:.1f}s' if wait >= 0.1 else '')
 
     def update(self, user_info: Optional[float] = None, reddit_activity: Optional[float] = None,
                loan_history: Optional[float] = None) -> None:
@@ -32,4 +43,3 @@ class ProgressTrackerWidget(Static):
             self.query_one('#reddit_activity', ProgressBar).update(progress=reddit_activity)
         if loan_history is not None:
             self.query_one('#loan_history', ProgressBar).update(progress=loan_history)
-        self.refresh()
@@ -1,11 +1,12 @@
 import datetime
-from collections import Counter, defaultdict
+from collections import Counter
 
 from rich.table import Table
 from textual.containers import Vertical
 from textual.widgets import Static, Sparkline, Label, Rule
 
 from const import ACTIVITY_DAYS_BACK
+from models.activity_aggregates import ActivityAggregates
 from models.user_data import UserData
 
 
@@ -15,6 +16,8 @@ class RedditActivityWidget(Static):
     def __init__(self, user_data: UserData, **kwargs):
         self.user_data = user_data
         self.days_back = ACTIVITY_DAYS_BACK
+        # Aggregates are computed when the user is loaded, only users built elsewhere lack them
+        self.activity = user_data.activity or ActivityAggregates.from_comments(user_data.comments)
         super().__init__(**kwargs)
 
     def on_mount(self) -> None:
@@ -29,20 +32,12 @@ class RedditActivityWidget(Static):
         table.add_column('comments')
         table.add_column('comment karma')
 
-        subreddit_counter = defaultdict(lambda: (0, 0))
-        for comment in self.user_data.comments:
-            count, karma = subreddit_counter[comment.subreddit]
-            subreddit_counter[comment.subreddit] = (count + 1, karma + comment.karma)
-
-        subreddit_counts = list(subreddit_counter.items())
-        subreddit_counts.sort(key=lambda sc: sc[1][0], reverse=True)
-
-        for subreddit_count in subreddit_counts:
-            subreddit_uri = f'r/{subreddit_count[0]}'
+        for subreddit, count, karma in self.activity.subreddits:
+            subreddit_uri = f'r/{subreddit}'
             table.add_row(
                 f'[link=https://reddit.com/{subreddit_uri}]{subreddit_uri}[/]',
-                str(subreddit_count[1][0]),
-                str(subreddit_count[1][1])
+                str(count),
+                str(karma)
             )
 
         container = Static()
@@ -50,19 +45,11 @@ class RedditActivityWidget(Static):
         return container
 
     def _get_activity_chart(self, label: str, days_back: int):
-        comments = self.user_data.comments
-
-        start_day = (datetime.datetime.now() - datetime.timedelta(days=days_back)).date()
-
-        # Trim and normalize point data
-        points = [c.created_at for c in comments if c.created_at >= start_day]
-
-        # Fill buckets
-        buckets = {start_day + datetime.timedelta(days=i): 0 for i in range(days_back + 1)}
-        for point in points:
-            buckets[point] += 1
+        today = datetime.datetime.now().date()
+        start_day = today - datetime.timedelta(days=days_back)
 
-        values = list(buckets.values())
+        # One bucket per day from the precomputed daily histogram
+        values = self.activity.window(start_day, today)
         counter = Counter(values)
 
         min_ = min(values)
@@ -73,5 +60,5 @@ class RedditActivityWidget(Static):
         row = Vertical(classes='reddit_activity_row')
         row.compose_add_child(Label(f'{label} ({days_back}d)'))
         row.compose_add_child(Label(f'[MIN={min_}] [MAX={max_}] [MEAN={mean_}] [MODE={mode_}]'))
-        row.compose_add_child(Sparkline(list(buckets.values())))
+        row.compose_add_child(Sparkline(values))
         return row
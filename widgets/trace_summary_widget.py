@@ -0,0 +1,59 @@
+import datetime
+import os
+
+from rich.table import Table
+from textual.app import ComposeResult
+from textual.containers import Horizontal, Vertical
+from textual.widgets import Static, Label, Button
+
+from util.tracing import Tracer
+
+_TRACE_DIR = 'data/traces'
+
+
+class TraceSummaryWidget(Static):
+    """
+    Where the last load of a user spent its time, totalled per stage, host and model call. Only
+    shown while tracing is on, e.g. in dev mode.
+    """
+
+    def __init__(self, username: str, **kwargs):
+        self.username = username
+        super().__init__(**kwargs)
+
+    def compose(self) -> ComposeResult:
+        with Vertical():
+            with Horizontal(classes='autoheight'):
+                yield Button('Export Chrome trace', classes='compact', id='export_chrome')
+                yield Button('Export JSON', classes='compact', id='export_json')
+            yield Label(id='trace_total')
+            yield Static(id='trace_table')
+
+    def on_mount(self) -> None:
+        root = Tracer.find_last('load user', username=self.username)
+        if root is None:
+            self.query_one('#trace_total', Label).update('No trace recorded for this user yet')
+            return
+
+        self.query_one('#trace_total', Label).update(
+            f'Last load took {root.duration_ms / 1000:.2f}s. Spans of concurrent calls overlap so '
+            f'their totals can add up to more')
+        table = Table(expand=True)
+        for column in ['category', 'name', 'count', 'total ms', 'max ms', 'bytes', 'retries',
+                       'cache hits', 'errors']:
+            table.add_column(column, justify='left' if column in ('category', 'name') else 'right')
+        for stats in Tracer.summary(root):
+            table.add_row(stats.category, stats.name, str(stats.count), f'{stats.total_ms:.0f}',
+                          f'{stats.max_ms:.0f}', str(stats.bytes), str(stats.retries),
+                          str(stats.cache_hits), str(stats.errors))
+        self.query_one('#trace_table', Static).update(table)
+
+    def on_button_pressed(self, event: Button.Pressed) -> None:
+        # Kept from reaching the screen, which switches tabs on button presses
+        event.stop()
+        fmt = 'chrome' if event.button.id == 'export_chrome' else 'json'
+        name = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        suffix = '.trace.json' if fmt == 'chrome' else '.json'
+        path = os.path.join(_TRACE_DIR, name + suffix)
+        Tracer.export(path, fmt)
+        self.app.notify(f'Trace saved to {path}')
@@ -1,17 +1,10 @@
-import datetime
-import time
-
 from rich.style import Style
 from rich.table import Table
 from textual.app import ComposeResult
 from textual.widgets import Static
 
 from models.user_data import UserData
-
-# Requirements
-_MIN_KARMA = 2000
-_MIN_COMMENT_KARMA = 800
-_MIN_AGE_DAYS = 120
+from models.vetting import RedFlags, account_age_days
 
 # Common Styles
 _RED_FLAG = Style(color='red', bold=True)
@@ -29,16 +22,24 @@ class UserInfoWidget(Static):
         table.add_column('value')
         table.add_column('')
 
-        age_days = (datetime.datetime.today().date() - self.user_data.created_at).days
+        red_flags = RedFlags.check(self.user_data)
+
+        def _value(value) -> str:
+            # Placeholders of a failed load aren't shown as real values
+            return 'unknown' if 'user info' in self.user_data.failed_stages else str(value)
 
         table.add_row('Name', self.user_data.username)
-        table.add_row('Account Age', str(age_days),
-                      style=_RED_FLAG if age_days < _MIN_AGE_DAYS else None)
-        table.add_row('Total Karma', str(self.user_data.total_karma),
-                      style=_RED_FLAG if self.user_data.total_karma < _MIN_KARMA else None)
-        table.add_row('Comment Karma', str(self.user_data.comment_karma),
-                      style=_RED_FLAG if self.user_data.comment_karma < _MIN_COMMENT_KARMA else None)
-        table.add_row('USL Status', 'FOUND' if self.user_data.is_in_usl else 'NOT FOUND',
+        table.add_row('Account Age', _value(account_age_days(self.user_data)),
+                      style=_RED_FLAG if red_flags.account_age else None)
+        table.add_row('Total Karma', _value(self.user_data.total_karma),
+                      style=_RED_FLAG if red_flags.total_karma else None)
+        table.add_row('Comment Karma', _value(self.user_data.comment_karma),
+                      style=_RED_FLAG if red_flags.comment_karma else None)
+        if 'USL status' in self.user_data.failed_stages:
+            usl_status = 'UNKNOWN, lookup failed'
+        else:
+            usl_status = 'FOUND' if self.user_data.is_in_usl else 'NOT FOUND'
+        table.add_row('USL Status', usl_status,
                       f'https://www.universalscammerlist.com/?username={self.user_data.username}',
-                      style=_RED_FLAG if self.user_data.is_in_usl else None)
+                      style=_RED_FLAG if red_flags.in_usl else None)
         self.update(table)